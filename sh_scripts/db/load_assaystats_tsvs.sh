@@ -0,0 +1,72 @@
+# Author: Jack Ringer
+# Date: 10/16/2026
+# Description:
+# Load compound/scaffold activity stats computed offline with src/compute_assaystats.py.
+# Alternative to annotate_compound_stats.sh + annotate_scaffold_stats.sh.
+
+if [ $# -lt 5 ]; then
+	printf "Syntax: %s DB_NAME DB_HOST SCHEMA COMPOUND_STATS_TSV SCAFFOLD_STATS_TSV [SCAF2ACTIVEAID_TSV] [SCAFFOLD_TABLE]\n" $0
+	exit
+fi
+
+DB_NAME=$1
+DB_HOST=$2
+SCHEMA=$3
+COMPOUND_STATS_TSV=$4
+SCAFFOLD_STATS_TSV=$5
+SCAF2ACTIVEAID_TSV=${6:-""} # optional
+SCAFFOLD_TABLE=${7:-"scaffold"} # optional
+
+# Step 1) compound stats
+psql -h $DB_HOST -d $DB_NAME <<EOF
+CREATE TEMP TABLE temp_compound_stats (
+    cid INTEGER PRIMARY KEY,
+    nsub_total INTEGER,
+    nsub_tested INTEGER,
+    nsub_active INTEGER,
+    nass_tested INTEGER,
+    nass_active INTEGER,
+    nsam_tested INTEGER,
+    nsam_active INTEGER
+);
+\COPY temp_compound_stats FROM '$COMPOUND_STATS_TSV' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
+UPDATE ${SCHEMA}.compound c
+SET (nsub_total, nsub_tested, nsub_active, nass_tested, nass_active, nsam_tested, nsam_active)
+  = (t.nsub_total, t.nsub_tested, t.nsub_active, t.nass_tested, t.nass_active, t.nsam_tested, t.nsam_active)
+FROM temp_compound_stats t
+WHERE c.cid = t.cid;
+DROP TABLE temp_compound_stats;
+EOF
+echo "Loaded compound stats."
+
+# Step 2) scaffold stats
+psql -h $DB_HOST -d $DB_NAME <<EOF
+CREATE TEMP TABLE temp_scaffold_stats (
+    id INTEGER PRIMARY KEY,
+    ncpd_total INTEGER,
+    ncpd_tested INTEGER,
+    ncpd_active INTEGER,
+    nsub_total INTEGER,
+    nsub_tested INTEGER,
+    nsub_active INTEGER,
+    nass_tested INTEGER,
+    nass_active INTEGER,
+    nsam_tested INTEGER,
+    nsam_active INTEGER
+);
+\COPY temp_scaffold_stats FROM '$SCAFFOLD_STATS_TSV' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
+UPDATE ${SCHEMA}.${SCAFFOLD_TABLE} s
+SET (ncpd_total, ncpd_tested, ncpd_active, nsub_total, nsub_tested, nsub_active, nass_tested, nass_active, nsam_tested, nsam_active)
+  = (t.ncpd_total, t.ncpd_tested, t.ncpd_active, t.nsub_total, t.nsub_tested, t.nsub_active, t.nass_tested, t.nass_active, t.nsam_tested, t.nsam_active)
+FROM temp_scaffold_stats t
+WHERE s.id = t.id;
+DROP TABLE temp_scaffold_stats;
+EOF
+echo "Loaded scaffold stats."
+
+# Step 3) (optional) scaf2activeaid
+if [ -n "$SCAF2ACTIVEAID_TSV" ]; then
+	psql -h $DB_HOST -d $DB_NAME -c "TRUNCATE TABLE ${SCHEMA}.scaf2activeaid" # in case we're re-running
+	psql -h $DB_HOST -d $DB_NAME -c "\COPY ${SCHEMA}.scaf2activeaid (scafid, aid) FROM '$SCAF2ACTIVEAID_TSV' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);"
+	echo "Loaded scaf2activeaid table."
+fi
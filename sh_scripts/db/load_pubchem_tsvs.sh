@@ -27,6 +27,16 @@ REPO_DIR=${13}
 
 # NOTE: using temp tables in psql commands to rename/drop columns from input TSVs
 
+# source for \COPY ... FROM: the file itself, or a TSV stream if it is a .parquet file
+# (BIOACTIVITY_CPD_SET/CID2SID/ACTIVITY files can be written as parquet by pubchem_assay_activities.py)
+copy_source() {
+	if [[ "$1" == *.parquet ]]; then
+		echo "PROGRAM 'python3 $REPO_DIR/src/parquet_to_tsv.py --i $1'"
+	else
+		echo "'$1'"
+	fi
+}
+
 # for DB comments
 HIERS_SCRIPT="generate_scaffolds.py"
 
@@ -90,7 +100,7 @@ CREATE TEMP TABLE staging_temp_compound2 (
     SMILES VARCHAR(2048) NOT NULL,
     CID TEXT
 );
-\COPY staging_temp_compound (CID, ISOMERIC_SMILES) FROM '$BIOACTIVITY_CPD_SET_TSV_PATH' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
+\COPY staging_temp_compound (CID, ISOMERIC_SMILES) FROM $(copy_source $BIOACTIVITY_CPD_SET_TSV_PATH) WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
 \COPY staging_temp_compound2 (mol_id, SMILES, CID) FROM '$CPD_TSV_PATH' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
 
 CREATE TEMP TABLE temp_compound AS
@@ -145,7 +155,7 @@ CREATE TEMP TABLE temp_sub2cpd (
 );
 
 -- Copy data into the staging table
-\COPY temp_sub2cpd (SID, CID) FROM '$CID2SID_TSV_PATH' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
+\COPY temp_sub2cpd (SID, CID) FROM $(copy_source $CID2SID_TSV_PATH) WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
 
 -- Remove rows with '<NA>' in CID and insert into the final table
 INSERT INTO ${SCHEMA}.sub2cpd (sid, cid)
@@ -169,7 +179,7 @@ CREATE TEMP TABLE temp_activity (
     SID INTEGER,
     ACTIVITY_OUTCOME INTEGER
 );
-\COPY temp_activity (AID, SID, ACTIVITY_OUTCOME) FROM '$ACTIVITY_TSV_PATH' WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
+\COPY temp_activity (AID, SID, ACTIVITY_OUTCOME) FROM $(copy_source $ACTIVITY_TSV_PATH) WITH (FORMAT CSV, DELIMITER E'\t', HEADER true);
 INSERT INTO ${SCHEMA}.activity (aid, sid, outcome) SELECT AID, SID, ACTIVITY_OUTCOME FROM temp_activity;
 DROP TABLE temp_activity;
 EOF
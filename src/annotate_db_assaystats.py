@@ -31,6 +31,7 @@ MLP Outcome codes:
 """
 
 import argparse
+import multiprocessing
 import sys
 import time
 
@@ -38,12 +39,163 @@ import psycopg2
 import psycopg2.extras
 
 from utils.custom_logging import get_and_set_logger
+from utils.db_write_buffer import CopyWriteBuffer
 from utils.file_utils import read_aid_file
 
 #############################################################################
 ACTIVE_CODES = (2, 5)
+COMPOUND_BUFFER_COLS = [
+    "cid",
+    "nsub_total",
+    "nsub_tested",
+    "nsub_active",
+    "nass_tested",
+    "nass_active",
+    "nsam_tested",
+    "nsam_active",
+]
+SCAFFOLD_BUFFER_COLS = [
+    "id",
+    "ncpd_total",
+    "ncpd_tested",
+    "ncpd_active",
+    "nsub_total",
+    "nsub_tested",
+    "nsub_active",
+    "nass_tested",
+    "nass_active",
+    "nsam_tested",
+    "nsam_active",
+]
+ASSAY_ID_TABLE = "selected_aid"  # temp table holding the custom AID selection (see LoadAssayIds())
+CHECKPOINT_TABLE = "annotation_checkpoint"
+CHECKPOINT_EVERY = 1000  # rows between checkpoints when writes are not buffered
 
 
+#############################################################################
+def LoadAssayIds(db, assay_ids):
+    """Load the custom AID selection into the (indexed) temp table ASSAY_ID_TABLE, which
+    AnnotateCompound()/AnnotateScaffold() join against instead of filtering on an AID list.
+    Temp tables are per-connection, so this is called once for each connection used.
+    Does nothing if assay_ids is empty/None.
+    """
+    if not assay_ids:
+        return
+    cur = db.cursor()
+    cur.execute(
+        f"CREATE TEMP TABLE IF NOT EXISTS {ASSAY_ID_TABLE} (aid INTEGER PRIMARY KEY)"
+    )
+    cur.execute(f"TRUNCATE {ASSAY_ID_TABLE}")
+    psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO {ASSAY_ID_TABLE} (aid) VALUES %s",
+        [(aid,) for aid in set(assay_ids)],
+    )
+    cur.execute(f"ANALYZE {ASSAY_ID_TABLE}")
+    db.commit()
+    cur.close()
+    logger.debug(f"Loaded {len(set(assay_ids))} AIDs into {ASSAY_ID_TABLE}")
+
+
+def EnsureCheckpointTable(db, dbschema):
+    """Create the {dbschema}.annotation_checkpoint table (one row per task holding the last completed id)
+    if it does not exist. CREATE TABLE IF NOT EXISTS is not safe to run concurrently in Postgres,
+    so this is called once before any (parallel) annotation pass rather than by each worker.
+    """
+    cur = db.cursor()
+    cur.execute(
+        f"""CREATE TABLE IF NOT EXISTS {dbschema}.{CHECKPOINT_TABLE} (
+        task VARCHAR(256) PRIMARY KEY,
+        last_id BIGINT NOT NULL,
+        updated TIMESTAMP NOT NULL DEFAULT NOW()
+    )"""
+    )
+    db.commit()
+    cur.close()
+
+
+def StartCheckpoint(db, dbschema, task: str, resume: bool):
+    """Prepare checkpointing for task (e.g. "compound" or "scaffold:<scaffold_table>").
+    Checkpoints are kept in the {dbschema}.annotation_checkpoint table (see EnsureCheckpointTable()).
+    If resume, returns the last completed id of the previous run (None if there is none).
+    Otherwise the checkpoint of any previous run is discarded and None is returned.
+    """
+    if task is None:
+        return None
+    cur = db.cursor()
+    last_id = None
+    if resume:
+        cur.execute(
+            f"SELECT last_id FROM {dbschema}.{CHECKPOINT_TABLE} WHERE task = %s",
+            (task,),
+        )
+        row = cur.fetchone()
+        last_id = row[0] if row is not None else None
+    else:
+        cur.execute(
+            f"DELETE FROM {dbschema}.{CHECKPOINT_TABLE} WHERE task = %s", (task,)
+        )
+    db.commit()
+    cur.close()
+    return last_id
+
+
+def SaveCheckpoint(
+    db, dbschema, task: str, last_id: int, write_buffers: list[CopyWriteBuffer] = ()
+):
+    """Record last_id as the last completed id of task. Pending rows in write_buffers
+    are flushed first, so everything up to last_id has been written when the checkpoint is committed.
+    If any write of the buffers failed (now or in an earlier flush), the checkpoint is not advanced,
+    so a resumed run annotates the failed rows again. Returns whether the checkpoint was saved.
+    """
+    ok = True
+    for write_buffer in write_buffers:
+        if write_buffer is not None:
+            write_buffer.flush()
+            ok = ok and not write_buffer.failed
+    if not ok:
+        logger.warning(
+            f"Checkpoint {task} kept before last_id={last_id}: a buffered write failed (see errors above), --resume will annotate these rows again"
+        )
+        return False
+    cur = db.cursor()
+    cur.execute(
+        f"""INSERT INTO {dbschema}.{CHECKPOINT_TABLE} (task, last_id) VALUES (%s, %s)
+        ON CONFLICT (task) DO UPDATE SET last_id = EXCLUDED.last_id, updated = NOW()""",
+        (task, last_id),
+    )
+    db.commit()
+    cur.close()
+    logger.debug(f"Checkpoint {task}: last_id={last_id}")
+    return True
+
+
+def ResumeIdLimit(
+    db,
+    table: str,
+    id_column: str,
+    id_filter: str,
+    params: tuple,
+    n_max: int,
+    n_skip: int,
+):
+    """Last id processed by a run with n_max/n_skip over the rows of table matching id_filter
+    (ordered by id_column), None if there is no such limit (n_max <= 0, or fewer rows).
+    A resumed run continues after its checkpoint up to this id, without skipping n_skip rows again.
+    """
+    if n_max <= 0:
+        return None
+    cur = db.cursor()
+    cur.execute(
+        f"SELECT {id_column} FROM {table} {id_filter} ORDER BY {id_column} LIMIT 1 OFFSET %s",
+        params + (max(n_skip, 0) + n_max - 1,),
+    )
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row is not None else None
+
+
+#############################################################################
 def AnnotateCompounds(
     db,
     dbschema,
@@ -53,8 +205,17 @@ def AnnotateCompounds(
     no_write,
     n_max=0,
     n_skip=0,
+    flush_size: int = 0,
+    checkpoint_task: str = None,
+    resume: bool = False,
 ):
-    """Loop over compounds. For each compound call AnnotateCompound()."""
+    """Loop over compounds (ordered by cid). For each compound call AnnotateCompound().
+    If flush_size > 0, compound updates are buffered and written in batches of flush_size rows
+    (see CopyWriteBuffer) rather than with one UPDATE + commit per compound.
+    If checkpoint_task is given, the last completed cid is checkpointed periodically (see SaveCheckpoint()).
+    With resume, compounds up to the checkpoint of the previous run are skipped, and the remaining
+    compounds are those the previous run (with the same n_skip/n_max) had not yet annotated.
+    """
     n_cpd_total = 0  # total compounds processed
     n_sub_total = 0  # total substances processed
     n_res_total = 0  # total results (outcomes) processed
@@ -62,8 +223,33 @@ def AnnotateCompounds(
     n_err = 0
     read_cur = db.cursor()
     write_cur = db.cursor()
-    sql = f"SELECT cid FROM {dbschema}.compound"
-    read_cur.execute(sql)
+    write_buffer = None
+    if flush_size > 0 and not no_write:
+        write_buffer = CopyWriteBuffer(
+            db,
+            f"{dbschema}.compound",
+            COMPOUND_BUFFER_COLS,
+            key_columns=["cid"],
+            flush_size=flush_size,
+        )
+    LoadAssayIds(db, assay_ids)
+    checkpoint_every = flush_size if flush_size > 0 else CHECKPOINT_EVERY
+    start_after = StartCheckpoint(db, dbschema, checkpoint_task, resume)
+    id_filter = "WHERE TRUE"
+    params = ()
+    if start_after is not None:
+        logger.info(f"Resuming after CID={start_after}")
+        cid_max = ResumeIdLimit(
+            db, f"{dbschema}.compound", "cid", id_filter, params, n_max, n_skip
+        )
+        id_filter += " AND cid > %s"
+        params += (start_after,)
+        if cid_max is not None:
+            id_filter += " AND cid <= %s"
+            params += (cid_max,)
+        n_max, n_skip = 0, 0  # (applied by the id filter)
+    sql = f"SELECT cid FROM {dbschema}.compound {id_filter} ORDER BY cid"
+    read_cur.execute(sql, params)
     cpd_rowcount = read_cur.rowcount  # use for progress msgs
     logger.debug(f"cpd rowcount={cpd_rowcount}")
 
@@ -98,12 +284,15 @@ def AnnotateCompounds(
             assay_id_tag,
             assay_ids,
             no_write,
+            write_buffer,
         )
         n_sub_total += sTotal
         n_res_total += wTested
         if ok_write:
             n_write += 1
         n_err += n_err_this
+        if checkpoint_task is not None and (n_cpd_total % checkpoint_every) == 0:
+            SaveCheckpoint(db, dbschema, checkpoint_task, cid, [write_buffer])
         if (n % 1000) == 0:
             logger.info(
                 f"n_cpd: {n_cpd_total} ; elapsed time: {time.time() - t0} ({100.0 * n_cpd_total / cpd_rowcount:.1f}% done)",
@@ -111,6 +300,12 @@ def AnnotateCompounds(
         row = read_cur.fetchone()
         if n_max > 0 and n_cpd_total >= n_max:
             break
+    if write_buffer is not None:
+        write_buffer.close()
+        n_write -= write_buffer.n_err
+        n_err += write_buffer.n_err
+    if checkpoint_task is not None and n_cpd_total > 0:
+        SaveCheckpoint(db, dbschema, checkpoint_task, cid, [write_buffer])
     read_cur.close()
     write_cur.close()
     db.close()
@@ -119,9 +314,19 @@ def AnnotateCompounds(
 
 #############################################################################
 def AnnotateCompound(
-    cid, cur, db, dbschema, dbschema_activity, assay_id_tag, assay_ids, no_write
+    cid,
+    cur,
+    db,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    no_write,
+    write_buffer: CopyWriteBuffer = None,
 ):
     """Annotate compound with assay statistics.
+    If write_buffer is given the compound row update is added to the buffer instead of executed directly.
+    If assay_ids is given, activity is restricted to the AIDs loaded with LoadAssayIds().
 
     For this compound, loop over substances. For each substance, loop over assay outcomes.
     Generate assay statistics. Update compound row.
@@ -134,11 +339,17 @@ def AnnotateCompound(
         wActive - active samples (wells) involving substances containing scaffold
     """
     # Fetch all relevant data in one query
+    # (with a custom AID selection, substances without selected activity are excluded entirely)
+    activity_join = f"LEFT JOIN {dbschema_activity}.activity a ON a.sid = s.sid"
+    if assay_ids:
+        activity_join = f"""JOIN {dbschema_activity}.activity a ON a.sid = s.sid
+    JOIN {ASSAY_ID_TABLE} sa ON sa.aid = a.{assay_id_tag}"""
     sql = f"""
     SELECT s.sid, a.{assay_id_tag}, a.outcome
     FROM {dbschema}.sub2cpd s
-    LEFT JOIN {dbschema_activity}.activity a ON a.sid = s.sid
+    {activity_join}
     WHERE s.cid = %s
+    ORDER BY s.sid
     """
 
     cur.execute(sql, (cid,))
@@ -154,10 +365,6 @@ def AnnotateCompound(
     # Group results by substance
     current_sid = None
     for sid, aid, outcome in cur.fetchall():
-        # Skip if assay not in custom selection
-        if assay_ids and aid not in assay_ids:
-            continue
-
         # Count new substance
         if sid != current_sid:
             sTotal += 1
@@ -200,7 +407,12 @@ def AnnotateCompound(
     ok_write = False
     n_err = 0
 
-    if not no_write:
+    if not no_write and write_buffer is not None:
+        write_buffer.add(
+            (cid, sTotal, sTested, sActive, aTested, aActive, wTested, wActive)
+        )
+        ok_write = True
+    elif not no_write:
         sql = f"""
         UPDATE {dbschema}.compound
         SET 
@@ -231,6 +443,122 @@ def AnnotateCompound(
     return sTotal, sTested, sActive, aTested, aActive, wTested, wActive, ok_write, n_err
 
 
+#############################################################################
+def AnnotateCompoundsBulk(
+    db,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    no_write,
+    cids: list[int] = None,
+):
+    """Annotate all compounds with assay statistics using a single set-based query.
+
+    Equivalent to AnnotateCompounds(), but computes the counters for every compound with
+    one grouped aggregation over sub2cpd/activity and applies them with one join UPDATE
+    (rather than one SELECT + UPDATE + commit per compound).
+    Compounds without any (selected) activity data are set to zero, as in AnnotateCompound().
+    If cids is given, only those compounds are (re-)annotated.
+    """
+    n_err = 0
+    params = {}
+    # mirror AnnotateCompound(): when a custom AID selection is given, rows outside of
+    # the selection (including substances without any activity) are ignored entirely
+    assay_filter = ""
+    if assay_ids:
+        assay_filter = f"AND a.{assay_id_tag} = ANY(%(assay_ids)s)"
+        params["assay_ids"] = list(assay_ids)
+    sub_cid_filter = ""
+    cpd_cid_filter = ""
+    if cids is not None:
+        sub_cid_filter = "AND s.cid = ANY(%(cids)s)"
+        cpd_cid_filter = "WHERE c.cid = ANY(%(cids)s)"
+        params["cids"] = list(cids)
+
+    counts_sql = f"""
+    WITH activity_data AS (
+        SELECT
+            s.cid,
+            s.sid,
+            a.{assay_id_tag} AS aid,
+            a.outcome
+        FROM {dbschema}.sub2cpd s
+        LEFT JOIN {dbschema_activity}.activity a ON a.sid = s.sid
+        WHERE TRUE {assay_filter} {sub_cid_filter}
+    ),
+    counts AS (
+        SELECT
+            cid,
+            COUNT(DISTINCT sid) AS sTotal,
+            COUNT(DISTINCT sid) FILTER (WHERE aid IS NOT NULL) AS sTested,
+            COUNT(DISTINCT sid) FILTER (WHERE aid IS NOT NULL AND outcome IN {ACTIVE_CODES}) AS sActive,
+            COUNT(DISTINCT aid) AS aTested,
+            COUNT(DISTINCT aid) FILTER (WHERE outcome IN {ACTIVE_CODES}) AS aActive,
+            COUNT(aid) AS wTested,
+            COUNT(aid) FILTER (WHERE outcome IN {ACTIVE_CODES}) AS wActive
+        FROM activity_data
+        GROUP BY cid
+    ),
+    compound_counts AS (
+        SELECT
+            c.cid,
+            COALESCE(x.sTotal, 0) AS sTotal,
+            COALESCE(x.sTested, 0) AS sTested,
+            COALESCE(x.sActive, 0) AS sActive,
+            COALESCE(x.aTested, 0) AS aTested,
+            COALESCE(x.aActive, 0) AS aActive,
+            COALESCE(x.wTested, 0) AS wTested,
+            COALESCE(x.wActive, 0) AS wActive
+        FROM {dbschema}.compound c
+        LEFT JOIN counts x ON x.cid = c.cid
+        {cpd_cid_filter}
+    )"""
+
+    if no_write:
+        sql = f"""{counts_sql}
+    SELECT COUNT(*), SUM(sTotal), SUM(wTested)
+    FROM compound_counts
+    """
+    else:
+        sql = f"""{counts_sql},
+    updated AS (
+        UPDATE {dbschema}.compound c
+        SET
+            nsub_total = cc.sTotal,
+            nsub_tested = cc.sTested,
+            nsub_active = cc.sActive,
+            nass_tested = cc.aTested,
+            nass_active = cc.aActive,
+            nsam_tested = cc.wTested,
+            nsam_active = cc.wActive
+        FROM compound_counts cc
+        WHERE c.cid = cc.cid
+        RETURNING cc.sTotal, cc.wTested
+    )
+    SELECT COUNT(*), SUM(sTotal), SUM(wTested)
+    FROM updated
+    """
+
+    cur = db.cursor()
+    t0 = time.time()
+    try:
+        cur.execute(sql, params)
+        n_cpd_total, n_sub_total, n_res_total = cur.fetchone()
+        db.commit()
+    except Exception as e:
+        logger.error(e)
+        db.rollback()
+        n_cpd_total, n_sub_total, n_res_total = 0, 0, 0
+        n_err = 1
+    finally:
+        cur.close()
+    logger.info(f"Bulk compound annotation elapsed time: {time.time() - t0}")
+
+    n_write = 0 if (no_write or n_err > 0) else n_cpd_total
+    return n_cpd_total, n_sub_total or 0, n_res_total or 0, n_write, n_err
+
+
 #############################################################################
 def AnnotateScaffolds(
     db,
@@ -244,8 +572,22 @@ def AnnotateScaffolds(
     write_scaf2activeaid=False,
     nass_tested_min: int = -1,
     scaffold_table: str = "scaffold",
+    scafid_min: int = None,
+    scafid_max: int = None,
+    scaf_ids: list[int] = None,
+    flush_size: int = 0,
+    checkpoint_task: str = None,
+    resume: bool = False,
 ):
-    """Loop over scaffolds.  For each scaffold call AnnotateScaffold().
+    """Loop over scaffolds (ordered by id).  For each scaffold call AnnotateScaffold().
+    If scafid_min/scafid_max are given, only scaffolds with scafid_min <= id <= scafid_max are considered.
+    If scaf_ids is given, only the scaffolds with those ids are considered.
+    If flush_size > 0, scaffold updates and scaf2activeaid inserts are buffered and written in batches
+    (see CopyWriteBuffer) rather than row by row.
+    If checkpoint_task is given, the last completed scaffold id is checkpointed periodically.
+    With resume, scaffolds up to the checkpoint of the previous run are skipped (the remaining scaffolds
+    are those the previous run, with the same n_skip/n_max, had not yet annotated), and scaf2activeaid
+    rows written for later scaffolds (before the previous run stopped) are removed so they are not duplicated.
     NOTE: This function presumes that the compound annotations have already been accomplished
     by AnnotateCompounds().
     """
@@ -259,10 +601,53 @@ def AnnotateScaffolds(
     read_cur = db.cursor()
     scaffold_read_cur = db.cursor()
     scaffold_write_cur = db.cursor()
-    sql = """SELECT id FROM {DBSCHEMA}.{SCAFFOLD_TABLE} ORDER BY id""".format(
-        SCAFFOLD_TABLE=scaffold_table, DBSCHEMA=dbschema
+    write_buffer, scaf2activeaid_buffer = None, None
+    if flush_size > 0 and not no_write:
+        write_buffer = CopyWriteBuffer(
+            db,
+            f"{dbschema}.{scaffold_table}",
+            SCAFFOLD_BUFFER_COLS,
+            key_columns=["id"],
+            flush_size=flush_size,
+        )
+        if write_scaf2activeaid:
+            scaf2activeaid_buffer = CopyWriteBuffer(
+                db,
+                f"{dbschema}.scaf2activeaid",
+                ["scafid", "aid"],
+                flush_size=flush_size,
+            )
+    id_filter = "WHERE TRUE"
+    params = ()
+    if scafid_min is not None and scafid_max is not None:
+        id_filter += " AND id >= %s AND id <= %s"
+        params += (scafid_min, scafid_max)
+    if scaf_ids is not None:
+        id_filter += " AND id = ANY(%s)"
+        params += (list(scaf_ids),)
+    LoadAssayIds(db, assay_ids)
+    checkpoint_every = flush_size if flush_size > 0 else CHECKPOINT_EVERY
+    start_after = StartCheckpoint(db, dbschema, checkpoint_task, resume)
+    if start_after is not None:
+        logger.info(f"Resuming after SCAFID={start_after}")
+        resume_scafid_max = ResumeIdLimit(
+            db, f"{dbschema}.{scaffold_table}", "id", id_filter, params, n_max, n_skip
+        )
+        id_filter += " AND id > %s"
+        params += (start_after,)
+        if resume_scafid_max is not None:
+            id_filter += " AND id <= %s"
+            params += (resume_scafid_max,)
+        else:
+            resume_scafid_max = scafid_max
+        n_max, n_skip = 0, 0  # (applied by the id filter)
+        # scaf2activeaid is only written when nass_tested_min > 1 (see AnnotateScaffold())
+        if write_scaf2activeaid and nass_tested_min > 1 and not no_write:
+            DeleteScaf2ActiveAids(db, dbschema, start_after, resume_scafid_max)
+    sql = """SELECT id FROM {DBSCHEMA}.{SCAFFOLD_TABLE} {ID_FILTER} ORDER BY id""".format(
+        SCAFFOLD_TABLE=scaffold_table, DBSCHEMA=dbschema, ID_FILTER=id_filter
     )
-    read_cur.execute(sql)
+    read_cur.execute(sql, params)
     scaf_rowcount = read_cur.rowcount  # use for progress msgs
     row = read_cur.fetchone()
     n = 0
@@ -303,6 +688,8 @@ def AnnotateScaffolds(
             write_scaf2activeaid,
             nass_tested_min,
             scaffold_table,
+            write_buffer,
+            scaf2activeaid_buffer,
         )
         n_cpd_total += cTotal
         n_sub_total += sTotal
@@ -310,6 +697,14 @@ def AnnotateScaffolds(
         if ok_write:
             n_write += 1
         n_err += n_err_this
+        if checkpoint_task is not None and (n_scaf_total % checkpoint_every) == 0:
+            SaveCheckpoint(
+                db,
+                dbschema,
+                checkpoint_task,
+                scaf_id,
+                [write_buffer, scaf2activeaid_buffer],
+            )
         if (n % 1000) == 0:
             logger.info(
                 "n_scaf: {} ; elapsed time: {} ({:.1f}% done)".format(
@@ -321,6 +716,21 @@ def AnnotateScaffolds(
         row = read_cur.fetchone()
         if n_max > 0 and n_scaf_total >= n_max:
             break
+    if write_buffer is not None:
+        write_buffer.close()
+        n_write -= write_buffer.n_err
+        n_err += write_buffer.n_err
+    if scaf2activeaid_buffer is not None:
+        scaf2activeaid_buffer.close()
+        n_err += scaf2activeaid_buffer.n_err
+    if checkpoint_task is not None and n_scaf_total > 0:
+        SaveCheckpoint(
+            db,
+            dbschema,
+            checkpoint_task,
+            scaf_id,
+            [write_buffer, scaf2activeaid_buffer],
+        )
     read_cur.close()
     scaffold_read_cur.close()
     scaffold_write_cur.close()
@@ -328,6 +738,213 @@ def AnnotateScaffolds(
     return n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err
 
 
+def DeleteScaf2ActiveAids(db, dbschema, scafid_after: int, scafid_max: int = None):
+    """Delete scaf2activeaid rows with scafid > scafid_after (and <= scafid_max, if given)."""
+    sql = f"DELETE FROM {dbschema}.scaf2activeaid WHERE scafid > %s"
+    params = (scafid_after,)
+    if scafid_max is not None:
+        sql += " AND scafid <= %s"
+        params += (scafid_max,)
+    cur = db.cursor()
+    cur.execute(sql, params)
+    logger.info(f"Removed {cur.rowcount} scaf2activeaid rows with scafid > {scafid_after}")
+    db.commit()
+    cur.close()
+
+
+#############################################################################
+def GetAffectedIds(
+    db,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    new_assay_ids,
+) -> tuple[list[int], list[int]]:
+    """Get the compounds (CIDs) and scaffolds whose statistics are affected by
+    the activity of the given (newly added) assays: AIDs -> SIDs -> CIDs -> scaffolds.
+    """
+    cur = db.cursor()
+    sql = f"""
+    SELECT DISTINCT s2c.cid
+    FROM {dbschema_activity}.activity a
+    JOIN {dbschema}.sub2cpd s2c ON s2c.sid = a.sid
+    WHERE a.{assay_id_tag} = ANY(%s)
+    """
+    cur.execute(sql, (list(new_assay_ids),))
+    cids = [row[0] for row in cur.fetchall()]
+    sql = f"SELECT DISTINCT scafid FROM {dbschema}.scaf2cpd WHERE cid = ANY(%s)"
+    cur.execute(sql, (cids,))
+    scaf_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return cids, scaf_ids
+
+
+def AnnotateIncremental(
+    db,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    new_assay_ids,
+    no_write,
+    annotate_compounds: bool,
+    annotate_scaffolds: bool,
+    write_scaf2activeaid=False,
+    nass_tested_min: int = -1,
+    scaffold_table: str = "scaffold",
+    flush_size: int = 0,
+):
+    """Update statistics after the activity of new assays (new_assay_ids) was appended to the DB.
+    Only compounds with activity in the new assays, and the scaffolds of those compounds, are touched.
+    Rather than adding the new results onto the existing counters, the affected rows are recomputed
+    from all of their activity: a substance/compound may already have been tested (or active) in other
+    assays, in which case nsub_* / nass_* must not be incremented again.
+    Returns (compound summary, scaffold summary) tuples (None if not annotated).
+    """
+    if assay_ids:
+        # new assays outside of a custom selection cannot affect the stats
+        new_assay_ids = set(new_assay_ids) & set(assay_ids)
+    cids, scaf_ids = GetAffectedIds(
+        db, dbschema, dbschema_activity, assay_id_tag, new_assay_ids
+    )
+    logger.info(
+        f"New assays: {len(new_assay_ids)} ; affected compounds: {len(cids)} ; affected scaffolds: {len(scaf_ids)}"
+    )
+    cpd_summary, scaf_summary = None, None
+    if annotate_compounds:
+        cpd_summary = AnnotateCompoundsBulk(
+            db,
+            dbschema,
+            dbschema_activity,
+            assay_id_tag,
+            assay_ids,
+            no_write,
+            cids=cids,
+        )
+    if annotate_scaffolds:
+        # scaf2activeaid is only (re-)written when nass_tested_min > 1 (see AnnotateScaffold())
+        if write_scaf2activeaid and nass_tested_min > 1 and not no_write:
+            # affected scaffolds are re-inserted by AnnotateScaffold()
+            cur = db.cursor()
+            cur.execute(
+                f"DELETE FROM {dbschema}.scaf2activeaid WHERE scafid = ANY(%s)",
+                (scaf_ids,),
+            )
+            db.commit()
+            cur.close()
+        scaf_summary = AnnotateScaffolds(
+            db,
+            dbschema,
+            dbschema_activity,
+            assay_id_tag,
+            assay_ids,
+            no_write,
+            write_scaf2activeaid=write_scaf2activeaid,
+            nass_tested_min=nass_tested_min,
+            scaffold_table=scaffold_table,
+            scaf_ids=scaf_ids,
+            flush_size=flush_size,
+        )
+    return cpd_summary, scaf_summary
+
+
+#############################################################################
+def _init_worker(log_fname, verbose):
+    """Set the module-level logger in (spawned) worker processes."""
+    global logger
+    logger = get_and_set_logger(log_fname, verbose)
+
+
+def _AnnotateScaffoldRange(db_params, scafid_min, scafid_max, annotate_kwargs):
+    """Worker: annotate scaffolds in [scafid_min, scafid_max] on a separate DB connection.
+    Each id range is checkpointed separately (resuming requires the same partitioning, i.e. same --workers/--nmax/--nskip).
+    """
+    db = connect_db(db_params)
+    annotate_kwargs = dict(annotate_kwargs)
+    if annotate_kwargs.get("checkpoint_task") is not None:
+        annotate_kwargs["checkpoint_task"] += f":{scafid_min}-{scafid_max}"
+    return AnnotateScaffolds(
+        db, scafid_min=scafid_min, scafid_max=scafid_max, **annotate_kwargs
+    )
+
+
+def AnnotateScaffoldsParallel(
+    db,
+    db_params: dict,
+    n_workers: int,
+    log_fname,
+    verbose: int,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    no_write,
+    n_max=0,
+    n_skip=0,
+    write_scaf2activeaid=False,
+    nass_tested_min: int = -1,
+    scaffold_table: str = "scaffold",
+    flush_size: int = 0,
+    checkpoint_task: str = None,
+    resume: bool = False,
+):
+    """Split the (ordered) scaffold ids into n_workers contiguous id ranges and run
+    AnnotateScaffolds() on each range concurrently, each worker using its own DB connection.
+    n_max/n_skip are applied to the ordered ids before partitioning, so the same scaffolds are
+    annotated as in the serial AnnotateScaffolds(). Returns the merged summary.
+    """
+    cur = db.cursor()
+    sql = f"SELECT id FROM {dbschema}.{scaffold_table} ORDER BY id"
+    params = []
+    if n_max > 0:
+        sql += " LIMIT %s"
+        params.append(n_max)
+    if n_skip > 0:
+        sql += " OFFSET %s"
+        params.append(n_skip)
+    cur.execute(sql, params)
+    scaf_ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    if checkpoint_task is not None:
+        # (created here, before the workers start their checkpoints concurrently)
+        EnsureCheckpointTable(db, dbschema)
+    db.close()
+
+    n_scafs = len(scaf_ids)
+    if n_scafs == 0:
+        return 0, 0, 0, 0, 0, 0
+    chunk_size = -(-n_scafs // n_workers)  # ceil division
+    id_ranges = [
+        (scaf_ids[i], scaf_ids[min(i + chunk_size, n_scafs) - 1])
+        for i in range(0, n_scafs, chunk_size)
+    ]
+    logger.info(
+        f"Annotating {n_scafs} scaffolds using {len(id_ranges)} workers (id ranges: {id_ranges})"
+    )
+    annotate_kwargs = dict(
+        dbschema=dbschema,
+        dbschema_activity=dbschema_activity,
+        assay_id_tag=assay_id_tag,
+        assay_ids=assay_ids,
+        no_write=no_write,
+        write_scaf2activeaid=write_scaf2activeaid,
+        nass_tested_min=nass_tested_min,
+        scaffold_table=scaffold_table,
+        flush_size=flush_size,
+        checkpoint_task=checkpoint_task,
+        resume=resume,
+    )
+    with multiprocessing.Pool(
+        len(id_ranges), initializer=_init_worker, initargs=(log_fname, verbose)
+    ) as pool:
+        results = pool.starmap(
+            _AnnotateScaffoldRange,
+            [(db_params, lo, hi, annotate_kwargs) for lo, hi in id_ranges],
+        )
+    # (n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err)
+    return tuple(sum(vals) for vals in zip(*results))
+
+
 #############################################################################
 def AnnotateScaffold(
     scaf_id,
@@ -342,6 +959,8 @@ def AnnotateScaffold(
     write_scaf2activeaid: bool = False,
     nass_tested_min: int = -1,
     scaffold_table: str = "scaffold",
+    write_buffer: CopyWriteBuffer = None,
+    scaf2activeaid_buffer: CopyWriteBuffer = None,
 ):
     """Annotate scaffold with assay statistics using aggregated SQL queries.
 
@@ -351,11 +970,13 @@ def AnnotateScaffold(
     dbschema (str): Name of the main database schema
     dbschema_activity (str): Name of the activity database schema
     assay_id_tag (str): The column name for the assay ID
-    assay_ids (set or None): Optional set of assay IDs to filter on
+    assay_ids (list or None): Optional assay IDs to filter on (must have been loaded with LoadAssayIds())
     no_write (bool): If True, don't update the database
     write_scaf2activeaid (bool): If True and not(no_write), write updates to the scaf2activeaid table
     nass_tested_min (int): If > 0 then will only annotate stats from compounds which have been tested in >= nass_tested_min different assays
     scaffold_table (str): Table to be updated if no_write = False
+    write_buffer (CopyWriteBuffer): If given, the scaffold row update is added to this buffer instead of executed directly
+    scaf2activeaid_buffer (CopyWriteBuffer): If given, scaf2activeaid rows are added to this buffer instead of inserted directly
 
     Returns:
     Tuple[int, int, int, int, int, int, int, int, int, int, int, bool, int]:
@@ -365,11 +986,10 @@ def AnnotateScaffold(
     n_err = 0
     ok_write = False
 
-    # Prepare the assay IDs filter if provided
-    assay_filter = ""
+    # Restrict to the custom AID selection (loaded with LoadAssayIds()) if provided
+    assay_join = ""
     if assay_ids:
-        assay_ids_str = ",".join(map(str, assay_ids))
-        assay_filter = f"AND a.{assay_id_tag} IN ({assay_ids_str})"
+        assay_join = f"JOIN {ASSAY_ID_TABLE} sa ON sa.aid = a.{assay_id_tag}"
 
     # SQL query to aggregate counts
     sql = f"""
@@ -395,7 +1015,8 @@ def AnnotateScaffold(
         FROM compound_data c
         JOIN {dbschema}.sub2cpd s2c ON s2c.cid = c.cid
         LEFT JOIN {dbschema_activity}.activity a ON a.sid = s2c.sid
-        WHERE a.{assay_id_tag} IS NOT NULL {assay_filter}
+        {assay_join}
+        WHERE a.{assay_id_tag} IS NOT NULL
     ),
     counts AS (
         SELECT
@@ -439,7 +1060,8 @@ def AnnotateScaffold(
         FROM all_compound_data c
         JOIN {dbschema}.sub2cpd s2c ON s2c.cid = c.cid
         LEFT JOIN {dbschema_activity}.activity a ON a.sid = s2c.sid
-        WHERE a.{assay_id_tag} IS NOT NULL {assay_filter}
+        {assay_join}
+        WHERE a.{assay_id_tag} IS NOT NULL
     ),
     active_assays_all AS (
         SELECT DISTINCT aid
@@ -485,47 +1107,28 @@ def AnnotateScaffold(
         nres_total,
     ) = result
 
-    # Update scaffold row
-    update_sql = f"""
-    UPDATE {dbschema}.{scaffold_table}
-    SET
-        ncpd_total = %s,
-        ncpd_tested = %s,
-        ncpd_active = %s,
-        nsub_total = %s,
-        nsub_tested = %s,
-        nsub_active = %s,
-        nass_tested = %s,
-        nass_active = %s,
-        nsam_tested = %s,
-        nsam_active = %s
-    WHERE
-        id = %s
-    """
-
     if not no_write:
-        try:
-            write_cur.execute(
-                update_sql,
-                (
-                    cTotal or 0,
-                    cTested or 0,
-                    cActive or 0,
-                    sTotal or 0,
-                    sTested or 0,
-                    sActive or 0,
-                    aTested or 0,
-                    aActive or 0,
-                    wTested or 0,
-                    wActive or 0,
-                    scaf_id,
-                ),
-            )
-            db.commit()
-            ok_write = True
-        except Exception as e:
-            logger.error(e)
-            n_err += 1
+        ok_write, n_err_this = WriteScaffoldRow(
+            scaf_id,
+            (
+                cTotal or 0,
+                cTested or 0,
+                cActive or 0,
+                sTotal or 0,
+                sTested or 0,
+                sActive or 0,
+                aTested or 0,
+                aActive or 0,
+                wTested or 0,
+                wActive or 0,
+            ),
+            db,
+            write_cur,
+            dbschema,
+            scaffold_table,
+            write_buffer,
+        )
+        n_err += n_err_this
 
     if (
         ok_write
@@ -533,14 +1136,9 @@ def AnnotateScaffold(
         and activeAssayIDs is not None
         and len(activeAssayIDs) > 0
     ):
-        try:
-            insert_query = "INSERT INTO scaf2activeaid (scafid, aid) VALUES (%s, %s)"
-            data = [(scaf_id, aid) for aid in activeAssayIDs]
-            write_cur.executemany(insert_query, data)
-            db.commit()
-        except Exception as e:
-            logger.error(e)
-            n_err += 1
+        n_err += WriteScaf2ActiveAids(
+            scaf_id, activeAssayIDs, db, write_cur, scaf2activeaid_buffer
+        )
 
     return (
         nres_total or 0,
@@ -560,6 +1158,442 @@ def AnnotateScaffold(
 
 
 #############################################################################
+def AnnotateScaffoldsMultiVariant(
+    db,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    no_write,
+    scaffold_variants: list[tuple[str, int]],
+    n_max=0,
+    n_skip=0,
+    write_scaf2activeaid=False,
+    flush_size: int = 0,
+    checkpoint_task: str = None,
+    resume: bool = False,
+):
+    """Loop over scaffolds (ordered by id).  For each scaffold call AnnotateScaffoldVariants().
+    Like AnnotateScaffolds(), but annotates several scaffold tables (variants), each with its own
+    nass_tested_min, using a single scan of the scaffold's activity data for all variants.
+    The variant tables are expected to be copies of the same scaffold table (same ids),
+    scaffold ids are read from the first one.
+    scaf2activeaid rows do not depend on nass_tested_min, so they are only written once (for the first
+    variant where AnnotateScaffolds() would write them).
+    Checkpointing/resume works as in AnnotateScaffolds().
+    Returns a dict mapping each scaffold_table to its summary
+    (n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err).
+    """
+    n_variants = len(scaffold_variants)
+    summaries = [[0, 0, 0, 0, 0, 0] for _ in range(n_variants)]
+    scaf2activeaid_variant = None
+    if write_scaf2activeaid and not no_write:
+        for i, (_, nass_tested_min) in enumerate(scaffold_variants):
+            if nass_tested_min > 1:
+                scaf2activeaid_variant = i
+                break
+
+    read_cur = db.cursor()
+    scaffold_read_cur = db.cursor()
+    scaffold_write_cur = db.cursor()
+    write_buffers = [None] * n_variants
+    scaf2activeaid_buffer = None
+    if flush_size > 0 and not no_write:
+        write_buffers = [
+            CopyWriteBuffer(
+                db,
+                f"{dbschema}.{scaffold_table}",
+                SCAFFOLD_BUFFER_COLS,
+                key_columns=["id"],
+                flush_size=flush_size,
+            )
+            for scaffold_table, _ in scaffold_variants
+        ]
+        if scaf2activeaid_variant is not None:
+            scaf2activeaid_buffer = CopyWriteBuffer(
+                db,
+                f"{dbschema}.scaf2activeaid",
+                ["scafid", "aid"],
+                flush_size=flush_size,
+            )
+    LoadAssayIds(db, assay_ids)
+    checkpoint_every = flush_size if flush_size > 0 else CHECKPOINT_EVERY
+    start_after = StartCheckpoint(db, dbschema, checkpoint_task, resume)
+    id_filter = "WHERE TRUE"
+    params = ()
+    if start_after is not None:
+        logger.info(f"Resuming after SCAFID={start_after}")
+        resume_scafid_max = ResumeIdLimit(
+            db,
+            f"{dbschema}.{scaffold_variants[0][0]}",
+            "id",
+            id_filter,
+            params,
+            n_max,
+            n_skip,
+        )
+        id_filter += " AND id > %s"
+        params += (start_after,)
+        if resume_scafid_max is not None:
+            id_filter += " AND id <= %s"
+            params += (resume_scafid_max,)
+        n_max, n_skip = 0, 0  # (applied by the id filter)
+        if scaf2activeaid_variant is not None:
+            DeleteScaf2ActiveAids(db, dbschema, start_after, resume_scafid_max)
+    sql = f"SELECT id FROM {dbschema}.{scaffold_variants[0][0]} {id_filter} ORDER BY id"
+    read_cur.execute(sql, params)
+    scaf_rowcount = read_cur.rowcount  # use for progress msgs
+    row = read_cur.fetchone()
+    n = 0
+    n_scaf_total = 0
+    t0 = time.time()
+
+    while row is not None:
+        n += 1
+        if n <= n_skip:
+            row = read_cur.fetchone()
+            continue
+        n_scaf_total += 1
+        scaf_id = row[0]
+        logger.debug("SCAFID={:4d}:".format(scaf_id))
+        results = AnnotateScaffoldVariants(
+            scaf_id,
+            db,
+            scaffold_read_cur,
+            scaffold_write_cur,
+            dbschema,
+            dbschema_activity,
+            assay_id_tag,
+            assay_ids,
+            no_write,
+            scaffold_variants,
+            scaf2activeaid_variant,
+            write_buffers,
+            scaf2activeaid_buffer,
+        )
+        for summary, result in zip(summaries, results):
+            nres_this, cTotal, sTotal = result[0], result[1], result[4]
+            ok_write, n_err_this = result[11], result[12]
+            summary[0] += 1
+            summary[1] += cTotal
+            summary[2] += sTotal
+            summary[3] += nres_this
+            if ok_write:
+                summary[4] += 1
+            summary[5] += n_err_this
+        if checkpoint_task is not None and (n_scaf_total % checkpoint_every) == 0:
+            SaveCheckpoint(
+                db,
+                dbschema,
+                checkpoint_task,
+                scaf_id,
+                write_buffers + [scaf2activeaid_buffer],
+            )
+        if (n % 1000) == 0:
+            logger.info(
+                "n_scaf: {} ; elapsed time: {} ({:.1f}% done)".format(
+                    n_scaf_total,
+                    time.strftime("%H:%M:%S", time.gmtime(time.time() - t0)),
+                    100.0 * n_scaf_total / scaf_rowcount,
+                )
+            )
+        row = read_cur.fetchone()
+        if n_max > 0 and n_scaf_total >= n_max:
+            break
+    for summary, write_buffer in zip(summaries, write_buffers):
+        if write_buffer is not None:
+            write_buffer.close()
+            summary[4] -= write_buffer.n_err
+            summary[5] += write_buffer.n_err
+    if scaf2activeaid_buffer is not None:
+        scaf2activeaid_buffer.close()
+        summaries[scaf2activeaid_variant][5] += scaf2activeaid_buffer.n_err
+    if checkpoint_task is not None and n_scaf_total > 0:
+        SaveCheckpoint(
+            db,
+            dbschema,
+            checkpoint_task,
+            scaf_id,
+            write_buffers + [scaf2activeaid_buffer],
+        )
+    read_cur.close()
+    scaffold_read_cur.close()
+    scaffold_write_cur.close()
+    db.close()
+    return {
+        scaffold_table: tuple(summary)
+        for (scaffold_table, _), summary in zip(scaffold_variants, summaries)
+    }
+
+
+#############################################################################
+def AnnotateScaffoldVariants(
+    scaf_id,
+    db,
+    read_cur,
+    write_cur,
+    dbschema,
+    dbschema_activity,
+    assay_id_tag,
+    assay_ids,
+    no_write,
+    scaffold_variants: list[tuple[str, int]],
+    scaf2activeaid_variant: int = None,
+    write_buffers: list[CopyWriteBuffer] = None,
+    scaf2activeaid_buffer: CopyWriteBuffer = None,
+):
+    """Annotate scaffold in several scaffold tables (variants) with assay statistics.
+
+    Same statistics as AnnotateScaffold(), but the compound and activity data of the scaffold
+    are only read once and then aggregated for each (scaffold_table, nass_tested_min) variant.
+
+    Parameters:
+    scaffold_variants (list[tuple[str, int]]): (scaffold_table, nass_tested_min) for each variant
+    scaf2activeaid_variant (int): If given (and not no_write), index of the variant whose row write
+        gates writing the scaffold's active assays to the scaf2activeaid table
+    write_buffers (list[CopyWriteBuffer]): (Optional) write buffer for each variant table
+    scaf2activeaid_buffer (CopyWriteBuffer): (Optional) write buffer for the scaf2activeaid table
+    (see AnnotateScaffold() for the other parameters)
+
+    Returns:
+    list of tuples (one per variant), as returned by AnnotateScaffold()
+    """
+    if write_buffers is None:
+        write_buffers = [None] * len(scaffold_variants)
+
+    # Restrict to the custom AID selection (loaded with LoadAssayIds()) if provided
+    assay_join = ""
+    if assay_ids:
+        assay_join = f"JOIN {ASSAY_ID_TABLE} sa ON sa.aid = a.{assay_id_tag}"
+
+    variant_values = ", ".join(
+        f"({i}, %s)" for i in range(len(scaffold_variants))
+    )
+    sql = f"""
+    WITH variants (variant, nass_tested_min) AS (
+        VALUES {variant_values}
+    ),
+    compound_data AS (
+        SELECT
+            c.cid,
+            c.nsub_total,
+            c.nsub_tested,
+            c.nsub_active,
+            c.nass_tested,
+            c.nsam_tested,
+            c.nsam_active
+        FROM {dbschema}.compound c
+        JOIN {dbschema}.scaf2cpd sc ON sc.cid = c.cid
+        WHERE sc.scafid = %s
+    ),
+    activity_data AS (
+        SELECT
+            c.cid,
+            c.nass_tested,
+            a.{assay_id_tag} AS aid,
+            a.outcome
+        FROM compound_data c
+        JOIN {dbschema}.sub2cpd s2c ON s2c.cid = c.cid
+        LEFT JOIN {dbschema_activity}.activity a ON a.sid = s2c.sid
+        {assay_join}
+        WHERE a.{assay_id_tag} IS NOT NULL
+    ),
+    counts AS (
+        SELECT
+            v.variant,
+            COUNT(DISTINCT c.cid) AS cTotal,
+            SUM(c.nsub_total) AS sTotal,
+            SUM(c.nsub_tested) AS sTested,
+            SUM(c.nsub_active) AS sActive,
+            SUM(c.nsam_tested) AS wTested,
+            SUM(c.nsam_active) AS wActive
+        FROM variants v
+        JOIN compound_data c ON c.nass_tested >= v.nass_tested_min
+        GROUP BY v.variant
+    ),
+    activity_counts AS (
+        SELECT
+            v.variant,
+            COUNT(DISTINCT a.cid) AS cTested,
+            COUNT(DISTINCT a.cid) FILTER (WHERE a.outcome IN {ACTIVE_CODES}) AS cActive,
+            COUNT(DISTINCT a.aid) AS aTested,
+            COUNT(DISTINCT a.aid) FILTER (WHERE a.outcome IN {ACTIVE_CODES}) AS aActive,
+            COUNT(*) AS nres_total
+        FROM variants v
+        JOIN activity_data a ON a.nass_tested >= v.nass_tested_min
+        GROUP BY v.variant
+    )
+    SELECT
+        counts.cTotal,
+        counts.sTotal,
+        counts.sTested,
+        counts.sActive,
+        counts.wTested,
+        counts.wActive,
+        activity_counts.cTested,
+        activity_counts.cActive,
+        activity_counts.aTested,
+        activity_counts.aActive,
+        activity_counts.nres_total,
+        (SELECT array_agg(DISTINCT aid) FROM activity_data WHERE outcome IN {ACTIVE_CODES})
+    FROM variants v
+    LEFT JOIN counts ON counts.variant = v.variant
+    LEFT JOIN activity_counts ON activity_counts.variant = v.variant
+    ORDER BY v.variant
+    """
+    params = tuple(nass_tested_min for _, nass_tested_min in scaffold_variants) + (
+        scaf_id,
+    )
+    read_cur.execute(sql, params)
+    rows = read_cur.fetchall()
+
+    # active assays from all of the scaffold's compounds (regardless of nass_tested_min)
+    activeAssayIDs = rows[0][-1] if len(rows) > 0 else None
+
+    results = []
+    for i, ((scaffold_table, _), row) in enumerate(zip(scaffold_variants, rows)):
+        (
+            cTotal,
+            sTotal,
+            sTested,
+            sActive,
+            wTested,
+            wActive,
+            cTested,
+            cActive,
+            aTested,
+            aActive,
+            nres_total,
+        ) = [x or 0 for x in row[:-1]]
+        ok_write = False
+        n_err = 0
+        if not no_write:
+            ok_write, n_err = WriteScaffoldRow(
+                scaf_id,
+                (
+                    cTotal,
+                    cTested,
+                    cActive,
+                    sTotal,
+                    sTested,
+                    sActive,
+                    aTested,
+                    aActive,
+                    wTested,
+                    wActive,
+                ),
+                db,
+                write_cur,
+                dbschema,
+                scaffold_table,
+                write_buffers[i],
+            )
+        if (
+            ok_write
+            and i == scaf2activeaid_variant
+            and activeAssayIDs is not None
+            and len(activeAssayIDs) > 0
+        ):
+            n_err += WriteScaf2ActiveAids(
+                scaf_id, activeAssayIDs, db, write_cur, scaf2activeaid_buffer
+            )
+        results.append(
+            (
+                nres_total,
+                cTotal,
+                cTested,
+                cActive,
+                sTotal,
+                sTested,
+                sActive,
+                aTested,
+                aActive,
+                wTested,
+                wActive,
+                ok_write,
+                n_err,
+            )
+        )
+    return results
+
+
+#############################################################################
+def WriteScaffoldRow(
+    scaf_id,
+    stats: tuple,
+    db,
+    write_cur,
+    dbschema,
+    scaffold_table: str = "scaffold",
+    write_buffer: CopyWriteBuffer = None,
+) -> tuple[bool, int]:
+    """Update scaffold row with stats (cTotal, cTested, cActive, sTotal, sTested, sActive,
+    aTested, aActive, wTested, wActive). If write_buffer is given the update is added to the
+    buffer instead of executed directly. Returns (ok_write, n_err)."""
+    if write_buffer is not None:
+        write_buffer.add((scaf_id,) + tuple(stats))
+        return True, 0
+
+    update_sql = f"""
+    UPDATE {dbschema}.{scaffold_table}
+    SET
+        ncpd_total = %s,
+        ncpd_tested = %s,
+        ncpd_active = %s,
+        nsub_total = %s,
+        nsub_tested = %s,
+        nsub_active = %s,
+        nass_tested = %s,
+        nass_active = %s,
+        nsam_tested = %s,
+        nsam_active = %s
+    WHERE
+        id = %s
+    """
+    try:
+        write_cur.execute(update_sql, tuple(stats) + (scaf_id,))
+        db.commit()
+        return True, 0
+    except Exception as e:
+        logger.error(e)
+        return False, 1
+
+
+def WriteScaf2ActiveAids(
+    scaf_id,
+    active_aids: list[int],
+    db,
+    write_cur,
+    scaf2activeaid_buffer: CopyWriteBuffer = None,
+) -> int:
+    """Insert (scaf_id, aid) rows into scaf2activeaid. Returns number of errors."""
+    if scaf2activeaid_buffer is not None:
+        for aid in active_aids:
+            scaf2activeaid_buffer.add((scaf_id, aid))
+        return 0
+    try:
+        insert_query = "INSERT INTO scaf2activeaid (scafid, aid) VALUES (%s, %s)"
+        data = [(scaf_id, aid) for aid in active_aids]
+        write_cur.executemany(insert_query, data)
+        db.commit()
+    except Exception as e:
+        logger.error(e)
+        return 1
+    return 0
+
+
+#############################################################################
+def scaffold_variant(arg: str) -> tuple[str, int]:
+    """Parse a "<scaffold_table>:<nass_tested_min>" argument."""
+    try:
+        scaffold_table, nass_tested_min = arg.rsplit(":", 1)
+        return scaffold_table, int(nass_tested_min)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Expected <scaffold_table>:<nass_tested_min>, given: {arg}"
+        )
+
+
 # Define argument parser
 def parse_arguments():
     # defaults
@@ -635,6 +1669,11 @@ def parse_arguments():
         action="store_true",
         help="Disable database writes (updates will be skipped)",
     )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Annotate all compounds with a single set-based query instead of one query per compound (ignores --nmax/--nskip)",
+    )
     parser.add_argument(
         "--write_scafid2activeaid",
         action="store_true",
@@ -658,6 +1697,36 @@ def parse_arguments():
         default="scaffold",
         help="Name of scaffolds table. Included as an argument in case DB has multiple scaffold tables to test different configurations (e.g., different args to --nass_tested_min) ",
     )
+    parser.add_argument(
+        "--new_aid_file",
+        type=str,
+        default=None,
+        help="(Optional) Incremental mode. File with newly added AssayIDs (whose activity has already been loaded). Only compounds/scaffolds with activity in these assays will be re-annotated",
+    )
+    parser.add_argument(
+        "--flush_size",
+        type=int,
+        default=10_000,
+        help="Number of row updates to buffer before writing them to the DB in one batch (via COPY). If <= 0 each row is written and committed individually (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes (each with its own DB connection) to use when annotating scaffolds. Scaffolds are partitioned by id range. Not used with --scaffold_variants or --new_aid_file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--scaffold_variants",
+        type=scaffold_variant,
+        nargs="+",
+        default=None,
+        help="(Optional) Annotate several scaffold tables in one pass, given as <scaffold_table>:<nass_tested_min> pairs (e.g., scaffold:0 scaffold_min5:5). Overrides --scaffold_table and --nass_tested_min",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run from its last checkpoint (compounds/scaffolds are processed in id order and the last completed id is checkpointed in the annotation_checkpoint table). Give the same --nmax/--nskip as the interrupted run: only the rows it had not annotated yet are processed. Not used with --bulk or --new_aid_file",
+    )
     parser.add_argument(
         "--log_fname",
         help="File to save logs to. If not given will log to stdout.",
@@ -666,16 +1735,38 @@ def parse_arguments():
     return parser.parse_args()
 
 
+def log_compound_summary(n_cpd_total, n_sub_total, n_res_total, n_write, n_err):
+    logger.info(
+        f"Compounds annotated: {n_cpd_total} ({n_sub_total} substances, {n_res_total} results), {n_write} rows updated"
+    )
+    if n_err > 0:
+        logger.info(f"Errors encountered: {n_err}")
+
+
+def log_scaffold_summary(
+    n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err
+):
+    logger.info(
+        f"Scaffolds annotated: {n_scaf_total} ({n_cpd_total} compounds, {n_sub_total} substances, {n_res_total} results), {n_write} rows updated"
+    )
+    if n_err > 0:
+        logger.info(f"Errors encountered: {n_err}")
+
+
+def connect_db(db_params: dict):
+    return psycopg2.connect(**db_params, cursor_factory=psycopg2.extras.DictCursor)
+
+
 def main(args):
     # Connect to the database
+    db_params = dict(
+        dbname=args.dbname,
+        host=args.host,
+        user=args.user,
+        password=args.password,
+    )
     try:
-        db = psycopg2.connect(
-            dbname=args.dbname,
-            host=args.host,
-            user=args.user,
-            password=args.password,
-            cursor_factory=psycopg2.extras.DictCursor,
-        )
+        db = connect_db(db_params)
     except Exception as e:
         logger.error(e)
         sys.exit(2)
@@ -686,28 +1777,52 @@ def main(args):
         logger.info(f"Will only annotate using AIDs from: {args.aid_file}")
         assay_ids = read_aid_file(args.aid_file)
 
-    # Annotate compounds
-    if args.annotate_compounds:
-        n_cpd_total, n_sub_total, n_res_total, n_write, n_err = AnnotateCompounds(
+    # Incremental update of the compounds/scaffolds affected by new assays
+    if args.new_aid_file is not None:
+        logger.info(f"Incremental annotation using new AIDs from: {args.new_aid_file}")
+        if args.workers > 1:
+            logger.warning("--workers is ignored when using --new_aid_file")
+        cpd_summary, scaf_summary = AnnotateIncremental(
             db,
             args.schema,
             args.activity,
             args.assay_id_tag,
             assay_ids,
+            read_aid_file(args.new_aid_file),
             args.no_write,
-            args.nmax,
-            args.nskip,
+            args.annotate_compounds,
+            args.annotate_scaffolds,
+            args.write_scafid2activeaid,
+            args.nass_tested_min,
+            args.scaffold_table,
+            args.flush_size,
         )
-        logger.info(
-            f"Compounds annotated: {n_cpd_total} ({n_sub_total} substances, {n_res_total} results), {n_write} rows updated"
-        )
-        if n_err > 0:
-            logger.info(f"Errors encountered: {n_err}")
+        if cpd_summary is not None:
+            log_compound_summary(*cpd_summary)
+        if scaf_summary is not None:
+            log_scaffold_summary(*scaf_summary)
+        return
 
-    # Annotate scaffolds
-    if args.annotate_scaffolds:
-        n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err = (
-            AnnotateScaffolds(
+    if not args.no_write:
+        EnsureCheckpointTable(db, args.schema)
+
+    # Annotate compounds
+    if args.annotate_compounds:
+        if args.bulk:
+            if args.nmax > 0 or args.nskip > 0:
+                logger.warning("--nmax/--nskip are ignored when using --bulk")
+            n_cpd_total, n_sub_total, n_res_total, n_write, n_err = (
+                AnnotateCompoundsBulk(
+                    db,
+                    args.schema,
+                    args.activity,
+                    args.assay_id_tag,
+                    assay_ids,
+                    args.no_write,
+                )
+            )
+        else:
+            n_cpd_total, n_sub_total, n_res_total, n_write, n_err = AnnotateCompounds(
                 db,
                 args.schema,
                 args.activity,
@@ -716,17 +1831,84 @@ def main(args):
                 args.no_write,
                 args.nmax,
                 args.nskip,
-                args.write_scafid2activeaid,
-                args.nass_tested_min,
-                args.scaffold_table,
+                args.flush_size,
+                checkpoint_task=None if args.no_write else "compound",
+                resume=args.resume,
             )
+        log_compound_summary(n_cpd_total, n_sub_total, n_res_total, n_write, n_err)
+
+    # Annotate scaffolds
+    if args.annotate_scaffolds and args.scaffold_variants is not None:
+        if args.workers > 1:
+            logger.warning("--workers is ignored when using --scaffold_variants")
+        variant_tables = [scaffold_table for scaffold_table, _ in args.scaffold_variants]
+        checkpoint_task = None if args.no_write else f"scaffold:{','.join(variant_tables)}"
+        summaries = AnnotateScaffoldsMultiVariant(
+            db,
+            args.schema,
+            args.activity,
+            args.assay_id_tag,
+            assay_ids,
+            args.no_write,
+            args.scaffold_variants,
+            args.nmax,
+            args.nskip,
+            args.write_scafid2activeaid,
+            args.flush_size,
+            checkpoint_task=checkpoint_task,
+            resume=args.resume,
         )
+        for scaffold_table, summary in summaries.items():
+            logger.info(f"Scaffold table: {scaffold_table}")
+            log_scaffold_summary(*summary)
+    elif args.annotate_scaffolds:
+        checkpoint_task = None if args.no_write else f"scaffold:{args.scaffold_table}"
+        if args.workers > 1:
+            n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err = (
+                AnnotateScaffoldsParallel(
+                    db,
+                    db_params,
+                    args.workers,
+                    args.log_fname,
+                    args.verbose,
+                    args.schema,
+                    args.activity,
+                    args.assay_id_tag,
+                    assay_ids,
+                    args.no_write,
+                    args.nmax,
+                    args.nskip,
+                    args.write_scafid2activeaid,
+                    args.nass_tested_min,
+                    args.scaffold_table,
+                    flush_size=args.flush_size,
+                    checkpoint_task=checkpoint_task,
+                    resume=args.resume,
+                )
+            )
+        else:
+            n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err = (
+                AnnotateScaffolds(
+                    db,
+                    args.schema,
+                    args.activity,
+                    args.assay_id_tag,
+                    assay_ids,
+                    args.no_write,
+                    args.nmax,
+                    args.nskip,
+                    args.write_scafid2activeaid,
+                    args.nass_tested_min,
+                    args.scaffold_table,
+                    flush_size=args.flush_size,
+                    checkpoint_task=checkpoint_task,
+                    resume=args.resume,
+                )
+            )
 
-        logger.info(
-            f"Scaffolds annotated: {n_scaf_total} ({n_cpd_total} compounds, {n_sub_total} substances, {n_res_total} results), {n_write} rows updated"
+        log_scaffold_summary(
+            n_scaf_total, n_cpd_total, n_sub_total, n_res_total, n_write, n_err
         )
-        if n_err > 0:
-            logger.info(f"Errors encountered: {n_err}")
 
 
 if __name__ == "__main__":
@@ -9,11 +9,13 @@ import argparse
 import sys
 from typing import Union
 
+import numpy as np
 import psycopg2
 import psycopg2.extras
 from psycopg2.extensions import cursor as Psycopg2Cursor
 
 from utils.custom_logging import get_and_set_logger
+from utils.db_write_buffer import CopyWriteBuffer
 
 
 def get_medians(
@@ -69,6 +71,52 @@ def compute_score(
     return pScore
 
 
+def compute_scores(
+    sTested: np.ndarray,
+    sActive: np.ndarray,
+    aTested: np.ndarray,
+    aActive: np.ndarray,
+    wTested: np.ndarray,
+    wActive: np.ndarray,
+    median_sTested: float,
+    median_aTested: float,
+    median_wTested: float,
+) -> np.ndarray:
+    """Vectorized version of compute_score(). Counts are given as arrays (NULL counts as NaN).
+    Returns a float array of scores with NaN meaning no evidence (None in compute_score()).
+    Operations are done in the same order as compute_score() and np.rint rounds half to even
+    like round(x, 0), so scores are identical."""
+    sTested = np.asarray(sTested, dtype=np.float64)
+    sActive = np.asarray(sActive, dtype=np.float64)
+    aTested = np.asarray(aTested, dtype=np.float64)
+    aActive = np.asarray(aActive, dtype=np.float64)
+    wTested = np.asarray(wTested, dtype=np.float64)
+    wActive = np.asarray(wActive, dtype=np.float64)
+    no_evidence = (
+        (sTested == 0)
+        | (aTested == 0)
+        | (wTested == 0)
+        | np.isnan(sTested)
+        | np.isnan(aTested)
+        | np.isnan(wTested)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pScores = (
+            1.0
+            * sActive
+            / (sTested + median_sTested)
+            * aActive
+            / (aTested + median_aTested)
+            * wActive
+            / (wTested + median_wTested)
+            * 100.0
+            * 1000.0
+        )
+    pScores = np.rint(pScores)  # round to whole number, matches badapple
+    pScores[no_evidence] = np.nan
+    return pScores
+
+
 def annotate_scaffold_scores(
     db_connection,
     cursor: Psycopg2Cursor,
@@ -78,6 +126,7 @@ def annotate_scaffold_scores(
     verbose: int,
     badapple_version: int,
     scaffold_table: str = "scaffold",
+    batch_size: int = 10_000,
 ) -> int:
 
     medians = get_medians(cursor, schema, badapple_version)
@@ -85,67 +134,69 @@ def annotate_scaffold_scores(
         for key, value in medians.items():
             logger.info(f"medians[{key}]: {value}")
 
+    # only fetch the counters needed for scoring
     sql = f"""
-    SELECT id, scafsmi, scaftree, ncpd_total, ncpd_tested, ncpd_active, 
-           nsub_total, nsub_tested, nsub_active, nass_tested, nass_active, 
-           nsam_tested, nsam_active, in_drug 
-    FROM {schema}.{scaffold_table} 
-    WHERE id >= %s AND id <= %s 
+    SELECT id, nsub_tested, nsub_active, nass_tested, nass_active,
+           nsam_tested, nsam_active
+    FROM {schema}.{scaffold_table}
+    WHERE id >= %s AND id <= %s
     ORDER BY id ASC
     """
 
-    cursor.execute(sql, (scafid_min, scafid_max))
-    rows = cursor.fetchall()
+    # scores are written (via COPY) after each batch
+    write_buffer = CopyWriteBuffer(
+        db_connection,
+        f"{schema}.{scaffold_table}",
+        ["id", "pscore"],
+        key_columns=["id"],
+        flush_size=batch_size,
+    )
+    # stream scaffolds through a server-side cursor so memory use does not depend on table size
+    # (WITH HOLD since the cursor needs to survive the commits from writing each batch)
+    stream_cursor = db_connection.cursor(
+        name=f"{scaffold_table}_score_cursor", withhold=True
+    )
+    stream_cursor.itersize = batch_size
+    stream_cursor.execute(sql, (scafid_min, scafid_max))
 
     n_scaf = 0
     n_update = 0
     n_null = 0
     n_zero = 0
     n_gtzero = 0
-
-    updates = []
-    for row in rows:
-        scafid = row[0]
-        sTested = row[7]
-        sActive = row[8]
-        aTested = row[9]
-        aActive = row[10]
-        wTested = row[11]
-        wActive = row[12]
-
-        pScore = compute_score(
-            sTested,
-            sActive,
-            aTested,
-            aActive,
-            wTested,
-            wActive,
+    rows = stream_cursor.fetchmany(batch_size)
+    while len(rows) > 0:
+        scafids = np.array([row[0] for row in rows], dtype=np.int64)
+        # sTested, sActive, aTested, aActive, wTested, wActive
+        counts = np.array([row[1:7] for row in rows], dtype=np.float64).reshape(-1, 6)
+        pScores = compute_scores(
+            *counts.T,
             medians["median_sTested"],
             medians["median_aTested"],
             medians["median_wTested"],
         )
-
-        if pScore is None:
-            n_null += 1
-        elif pScore == 0.0:
-            n_zero += 1
-        else:
-            n_gtzero += 1
-
-        if pScore is not None:
-            updates.append((pScore, scafid))
+        has_score = ~np.isnan(pScores)
+        n_scaf += len(scafids)
+        n_null += int(np.sum(~has_score))
+        n_zero += int(np.sum(pScores == 0.0))
+        n_gtzero += int(np.sum(has_score & (pScores != 0.0)))
+        for scafid, pScore in zip(
+            scafids[has_score].tolist(), pScores[has_score].tolist()
+        ):
+            write_buffer.add((scafid, pScore))
             n_update += 1
-        n_scaf += 1
-        if verbose > 0 and (n_scaf % 1000) == 0:
+        write_buffer.flush()
+        if verbose > 0:
             logger.info(
                 f"n_scaf: {n_scaf} ({int(100 * n_scaf / (scafid_max - scafid_min + 1))}%)"
             )
+        rows = stream_cursor.fetchmany(batch_size)
+    stream_cursor.close()
 
-    # execute updates in batch (better performance):
-    logger.info("Committing changes..")
-    update_sql = f"UPDATE {schema}.{scaffold_table} SET pscore = %s WHERE id = %s"
-    cursor.executemany(update_sql, updates)
-    db_connection.commit()
+    write_buffer.close()
+    if write_buffer.n_err > 0:
+        logger.error(f"Failed to write {write_buffer.n_err} scores")
+        n_update -= write_buffer.n_err
 
     if n_scaf == 0:
         logger.error("ERROR: annotate_scaffold_scores() data not found.")
@@ -219,6 +270,12 @@ def parse_arguments():
         default="scaffold",
         help="Name of scaffolds table. Included as an argument in case DB has multiple scaffold tables to test different configurations (e.g., different args to --nass_tested_min) ",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10_000,
+        help="Number of scaffolds fetched, scored and written to the DB per batch (default: %(default)s)",
+    )
     return parser.parse_args()
 
 
@@ -249,6 +306,7 @@ def main(args):
             args.verbose,
             args.badapple_version,
             args.scaffold_table,
+            args.batch_size,
         )
         logger.info(f"scafs processed: {n_scaf_done}")
     finally:
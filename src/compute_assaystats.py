@@ -0,0 +1,127 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Compute compound and scaffold assay statistics offline (without Postgres), directly from the
+outputs of pubchem_assay_activities.py and generate_scaffolds.py.
+Produces the same columns as annotate_db_assaystats.py as TSV files which can be loaded
+into the DB with \\COPY (see sh_scripts/db/load_assaystats_tsvs.sh).
+"""
+
+import argparse
+import time
+
+from utils.assay_stats import AssayStatsEngine
+from utils.custom_logging import get_and_set_logger
+from utils.file_utils import read_aid_file
+
+
+def parse_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--activity_tsv",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="TSV (or .parquet) file mapping AID, SID, and activity outcome (--o_assaystats from pubchem_assay_activities.py)",
+    )
+    parser.add_argument(
+        "--sub2cpd_tsv",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="TSV (or .parquet) file mapping SID to CID (--o_sid2cid from pubchem_assay_activities.py)",
+    )
+    parser.add_argument(
+        "--compound_tsv",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="TSV file with compounds (--o_mol from generate_scaffolds.py)",
+    )
+    parser.add_argument(
+        "--scaf2cpd_tsv",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="TSV file mapping compounds to scaffolds (--o_mol2scaf from generate_scaffolds.py)",
+    )
+    parser.add_argument(
+        "--o_compound_stats",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="output TSV file with compound statistics (one row per CID)",
+    )
+    parser.add_argument(
+        "--o_scaffold_stats",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="output TSV file with scaffold statistics (one row per scaffold id)",
+    )
+    parser.add_argument(
+        "--o_scaf2activeaid",
+        type=str,
+        default=None,
+        help="(Optional) output TSV file with (scafid, aid) pairs for the scaf2activeaid table",
+    )
+    parser.add_argument(
+        "--aid_file",
+        type=str,
+        default=None,
+        help="(Optional) If given, will only compute statistics using AssayIDs contained in the given file",
+    )
+    parser.add_argument(
+        "--nass_tested_min",
+        type=int,
+        default=-1,
+        help="(Optional) If given, will only compute scaffold statistics using compounds which were tested in at least --nass_tested_min different assays",
+    )
+    parser.add_argument(
+        "--log_fname",
+        help="File to save logs to. If not given will log to stdout.",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    logger = get_and_set_logger(args.log_fname)
+    assay_ids = None
+    if args.aid_file is not None and len(args.aid_file) > 0 and args.aid_file != "NULL":
+        logger.info(f"Will only compute statistics using AIDs from: {args.aid_file}")
+        assay_ids = set(read_aid_file(args.aid_file))
+
+    t0 = time.time()
+    logger.info("Reading input files...")
+    engine = AssayStatsEngine.from_tsv_files(
+        args.activity_tsv, args.sub2cpd_tsv, args.compound_tsv, args.scaf2cpd_tsv
+    )
+    logger.info(
+        f"Loaded {len(engine.act_aid)} activity results, {len(engine.cids)} compounds, {len(engine.scafids)} scaffolds (elapsed time: {time.time() - t0:.1f}s)"
+    )
+
+    logger.info("Computing compound statistics...")
+    compound_stats = engine.compute_compound_stats(assay_ids)
+    compound_stats.to_csv(args.o_compound_stats, sep="\t", index=False)
+    logger.info(f"Wrote compound statistics to: {args.o_compound_stats}")
+
+    logger.info("Computing scaffold statistics...")
+    scaffold_stats, scaf2activeaid = engine.compute_scaffold_stats(
+        compound_stats, assay_ids, args.nass_tested_min
+    )
+    scaffold_stats.to_csv(args.o_scaffold_stats, sep="\t", index=False)
+    logger.info(f"Wrote scaffold statistics to: {args.o_scaffold_stats}")
+    if args.o_scaf2activeaid is not None:
+        scaf2activeaid.to_csv(args.o_scaf2activeaid, sep="\t", index=False)
+        logger.info(f"Wrote scaf2activeaid pairs to: {args.o_scaf2activeaid}")
+    logger.info(f"Done! (elapsed time: {time.time() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute compound and scaffold assay statistics from pipeline TSV files (no DB required)",
+        epilog="",
+    )
+    args = parse_args(parser)
+    main(args)
@@ -10,12 +10,18 @@ badapple database.
 """
 
 import argparse
+import multiprocessing
+from functools import partial
+from itertools import islice
 
 from rdkit import Chem
+from tqdm import tqdm
 
+from utils.compact_scaffold_graph import CompactScaffoldGraph
 from utils.custom_logging import get_and_set_logger
-from utils.file_utils import close_file, get_csv_writer
+from utils.file_utils import close_file, get_csv_writer, is_parquet_file, read_table
 from utils.hiers import CustomHierS
+from utils.scaffold_hierarchy import ScaffoldHierarchy
 
 
 def parse_args(parser: argparse.ArgumentParser):
@@ -24,7 +30,7 @@ def parse_args(parser: argparse.ArgumentParser):
         type=str,
         required=True,
         default=argparse.SUPPRESS,
-        help="input compounds (SMI/TSV file)",
+        help="input compounds (SMI/TSV file, or .parquet file with columns in the same order)",
     )
     parser.add_argument(
         "--o_scaf",
@@ -91,6 +97,35 @@ def parse_args(parser: argparse.ArgumentParser):
         default=1,
         help="(integer) column where molecule names are located (for input SMI file). Names should be unique!",
     )
+    parser.add_argument(
+        "--fragment_cache",
+        type=str,
+        default=None,
+        help="(Optional) SQLite file caching fragmentation results across runs (created if it does not exist). Molecules (by canonical SMILES) found in the cache are not fragmented again, output is the same as without the cache.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. If > 1, the input is split into shards of --shard_size molecules which are fragmented in parallel and then merged. Output files are the same as with one process.",
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=10_000,
+        help="Number of input molecules per shard with --workers > 1, --graph_backend compact, or --stream (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--graph_backend",
+        choices=["networkx", "compact"],
+        default="networkx",
+        help="Scaffold graph representation. With compact, the input is processed in shards of --shard_size molecules (see --workers) which are merged into a graph stored in NumPy arrays, so much less memory is needed for large inputs. Output files are the same for both (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write molecule and mol2scaf rows shard by shard (see --shard_size) as molecules are processed, rather than after the whole scaffold graph is built; the scaffold table is written at the end. Only the scaffold hierarchy is kept in memory. Scaffold ids and file contents are the same as without --stream, except that mol_id counts from 0 (rather than from the number of scaffolds) and molecules are not de-duplicated by name across shards.",
+    )
     parser.add_argument(
         "--log_fname",
         help="File to save logs to. If not given will log to stdout.",
@@ -129,13 +164,125 @@ def _get_sub_scaffolds(scaffold_graph, scaf_id: int, scaf_smile: str, scaf_smile
     return scaf2scaf_str
 
 
+def iter_shards(args):
+    # yields consecutive parts of the input: SMILES file contents (text) or DataFrames (.parquet input)
+    if is_parquet_file(args.i):
+        cpd_df = read_table(args.i).astype(str)
+        for start in range(0, len(cpd_df), args.shard_size):
+            yield cpd_df.iloc[start : start + args.shard_size]
+        return
+    with open(args.i, "r") as f:
+        header = f.readline() if args.iheader else ""
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) == args.shard_size:
+                yield header + "".join(lines)
+                lines = []
+        if len(lines) > 0:
+            yield header + "".join(lines)
+
+
+def _init_worker(log_fname):
+    global logger
+    logger = get_and_set_logger(log_fname)
+
+
+def _build_shard(shard, args) -> ScaffoldHierarchy:
+    if isinstance(shard, str):
+        network = CustomHierS.from_smiles_text(
+            shard,
+            header=args.iheader,
+            delimiter=args.idelim,
+            smiles_column=args.smiles_column,
+            name_column=args.name_column,
+            ring_cutoff=args.max_rings,
+            fragment_cache_file=args.fragment_cache,
+        )
+    else:
+        network = CustomHierS.from_dataframe(
+            shard,
+            smiles_column=shard.columns[args.smiles_column],
+            name_column=shard.columns[args.name_column],
+            ring_cutoff=args.max_rings,
+            fragment_cache_file=args.fragment_cache,
+        )
+    return ScaffoldHierarchy.from_hiers(network)
+
+
+def iter_shard_hierarchies(args):
+    """ScaffoldHierarchy of each input shard (see iter_shards()) in input order, built by args.workers processes."""
+    build_shard = partial(_build_shard, args=args)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(
+            args.workers, initializer=_init_worker, initargs=(args.log_fname,)
+        )
+        yield from pool.imap(build_shard, iter_shards(args))
+        pool.close()
+        pool.join()
+    else:
+        yield from map(build_shard, iter_shards(args))
+
+
+def build_sharded(
+    args, network: ScaffoldHierarchy | CompactScaffoldGraph
+) -> ScaffoldHierarchy | CompactScaffoldGraph:
+    """Build the scaffold hierarchy of the input shard by shard (with args.workers processes).
+    Shards are merged into network in input order, so the result matches a graph built by one process."""
+    for shard_network in tqdm(iter_shard_hierarchies(args), desc="Shards"):
+        network.merge(shard_network)
+    return network
+
+
+def kekule_smiles(scaf_rep: str, identifier_type: str) -> str | None:
+    # None if the scaffold can't be kekulized
+    try:
+        if identifier_type == "inchi":
+            mol = Chem.MolFromInchi(scaf_rep)
+        else:
+            mol = Chem.MolFromSmiles(scaf_rep)
+        return Chem.MolToSmiles(mol, canonical=True, kekuleSmiles=True)
+    except:
+        return None
+
+
+def get_kekule_smiles(
+    scaf_reps: list[str], identifier_type: str, workers: int = 1
+) -> list[str | None]:
+    # Kekule SMILES of each scaffold (see kekule_smiles()), computed by workers processes
+    func = partial(kekule_smiles, identifier_type=identifier_type)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            return pool.map(func, scaf_reps, chunksize=1000)
+    return [func(scaf_rep) for scaf_rep in scaf_reps]
+
+
+def get_scaf_header(
+    identifier_type: str, include_kekule_smiles: bool
+) -> tuple[list[str], bool]:
+    # header of the scaffold file, and whether it has a kekule_smiles column
+    scaf_header = [
+        "scaffold_id",
+        identifier_type,
+        "hierarchy",
+        "scaf2scaf",
+    ]
+    include_kekule_smiles = (include_kekule_smiles) and (
+        identifier_type != "kekule_smiles"
+    )  # no point in having two identical columns
+    if include_kekule_smiles:
+        scaf_header.insert(2, "kekule_smiles")
+    return scaf_header, include_kekule_smiles
+
+
 def write_outs(
-    scaffold_graph: CustomHierS,
+    scaffold_graph: CustomHierS | ScaffoldHierarchy | CompactScaffoldGraph,
     include_kekule_smiles: bool,
     o_mol: str,
     o_scaf: str,
     o_mol2scaf: str,
     odelimeter: str,
+    workers: int = 1,
 ) -> None:
     # idx == ids
     mol_writer, f_mol = get_csv_writer(o_mol, odelimeter)
@@ -146,29 +293,35 @@ def write_outs(
     mol_writer.writerow(["mol_id", "smiles", "mol_name"])
 
     identifier_type = scaffold_graph.identifier_type
-    scaf_header = [
-        "scaffold_id",
-        identifier_type,
-        "hierarchy",
-        "scaf2scaf",
-    ]
     check_kekule = include_kekule_smiles
-    include_kekule_smiles = (include_kekule_smiles) and (
-        identifier_type != "kekule_smiles"
-    )  # no point in having two identical columns
-    if include_kekule_smiles:
-        scaf_header.insert(2, "kekule_smiles")
+    scaf_header, include_kekule_smiles = get_scaf_header(
+        identifier_type, include_kekule_smiles
+    )
     scaf_writer.writerow(scaf_header)
 
     mol2scaf_writer.writerow(["mol_id", "mol_name", "scaffold_id"])
 
     seen_scafs = {}
-    seen_invalid_scafs = {}
     N = scaffold_graph.num_scaffold_nodes
     # for the "id" just use indexing
-    scaf_rep_to_id = dict(
-        zip([s for s in scaffold_graph.get_scaffold_nodes()], range(0, N))
+    scaf_reps = list(scaffold_graph.get_scaffold_nodes())
+    scaf_rep_to_id = dict(zip(scaf_reps, range(0, N)))
+    # scaffolds excluded from output (by id), checked once per scaffold
+    seen_invalid_scafs = set(
+        scaf_id
+        for scaf_id, scaf_rep in enumerate(scaf_reps)
+        if not is_valid_scaf(scaf_rep)
     )
+    scaf_kekule_smiles = [""] * N
+    if check_kekule:
+        # track un-kekulizable scaffolds
+        scaf_kekule_smiles = get_kekule_smiles(scaf_reps, identifier_type, workers)
+        for scaf_id, kekule_smiles in enumerate(scaf_kekule_smiles):
+            if kekule_smiles is None:
+                logger.info(
+                    f"Unable to generate Kekule SMILES for scaffold {scaf_reps[scaf_id]} - excluding from output file"
+                )
+                seen_invalid_scafs.add(scaf_id)
     cur_id = N
     for mol_node in scaffold_graph.get_molecule_nodes(data=True):
         mol_name = mol_node[0]
@@ -180,71 +333,172 @@ def write_outs(
         for scaf_node in mol_scaffolds:
             scaf_rep = scaf_node[0]  # can be either inchi or smiles
             scaf_id = scaf_rep_to_id[scaf_rep]
-            kekule_smiles = ""
-            if check_kekule:
-                # track un-kekulizable scaffolds
-                try:
-                    if identifier_type == "inchi":
-                        mol = Chem.MolFromInchi(scaf_rep)
-                    else:
-                        mol = Chem.MolFromSmiles(scaf_rep)
-                    kekule_smiles = Chem.MolToSmiles(
-                        mol, canonical=True, kekuleSmiles=True
-                    )
-                except:
+            if scaf_id in seen_invalid_scafs:
+                continue
+            mol2scaf_writer.writerow([mol_id, mol_name, scaf_id])
+            if scaf_id not in seen_scafs:
+                scaf_hierarchy = scaf_node[1]["hierarchy"]
+                scaf2scaf_str = _get_sub_scaffolds(
+                    scaffold_graph, scaf_id, scaf_rep, scaf_rep_to_id
+                )
+                scaf_row = [
+                    scaf_id,
+                    scaf_rep,
+                    scaf_hierarchy,
+                    scaf2scaf_str,
+                ]
+                if include_kekule_smiles:
+                    scaf_row.insert(2, scaf_kekule_smiles[scaf_id])
+                scaf_writer.writerow(scaf_row)
+                seen_scafs[scaf_id] = True
+    close_file(f_mol)
+    close_file(f_scaf)
+    close_file(f_mol2scaf)
+
+
+def write_outs_streaming(args, odelimeter: str) -> tuple[ScaffoldHierarchy, int]:
+    """
+    Build the scaffold hierarchy shard by shard (see iter_shard_hierarchies()) and write the molecule
+    and mol2scaf rows of each shard as soon as it is merged; the molecules of a shard are then dropped.
+    Scaffold ids are assigned on first sight (as the node order of write_outs()), the scaffold table
+    (which needs the complete scaf2scaf links) is written at the end.
+    Returns the scaffold hierarchy and the number of molecules written.
+    """
+    mol_writer, f_mol = get_csv_writer(args.o_mol, odelimeter)
+    mol2scaf_writer, f_mol2scaf = get_csv_writer(args.o_mol2scaf, odelimeter)
+    mol_writer.writerow(["mol_id", "smiles", "mol_name"])
+    mol2scaf_writer.writerow(["mol_id", "mol_name", "scaffold_id"])
+
+    scaffold_graph = ScaffoldHierarchy()
+    scaf_reps = []  # id -> identifier
+    scaf_rep_to_id = {}
+    scaf_kekule_smiles = []
+    seen_invalid_scafs = set()
+    seen_scafs = set()
+    scaf_order = []  # scaffold ids in order of first mol2scaf row (row order of write_outs())
+    mol_id = 0
+    for shard_network in tqdm(iter_shard_hierarchies(args), desc="Shards"):
+        scaffold_graph.merge(shard_network)
+        new_reps = list(islice(scaffold_graph.scaffolds, len(scaf_reps), None))
+        for scaf_id, scaf_rep in enumerate(new_reps, start=len(scaf_reps)):
+            scaf_rep_to_id[scaf_rep] = scaf_id
+            if not is_valid_scaf(scaf_rep):
+                seen_invalid_scafs.add(scaf_id)
+        scaf_reps.extend(new_reps)
+        if args.include_kekule_smiles:
+            # track un-kekulizable scaffolds
+            new_kekule_smiles = get_kekule_smiles(
+                new_reps, scaffold_graph.identifier_type, args.workers
+            )
+            for scaf_rep, kekule_smiles in zip(new_reps, new_kekule_smiles):
+                if kekule_smiles is None:
                     logger.info(
                         f"Unable to generate Kekule SMILES for scaffold {scaf_rep} - excluding from output file"
                     )
-                    seen_invalid_scafs[scaf_id] = True
-            if scaf_id in seen_invalid_scafs or not (is_valid_scaf(scaf_rep)):
-                seen_invalid_scafs[scaf_id] = True
-            else:
+                    seen_invalid_scafs.add(scaf_rep_to_id[scaf_rep])
+            scaf_kekule_smiles.extend(new_kekule_smiles)
+
+        for mol_name, mol_data in scaffold_graph.get_molecule_nodes(data=True):
+            mol_writer.writerow([mol_id, mol_data["smiles"], mol_name])
+            for scaf_rep in scaffold_graph.get_scaffolds_for_molecule(mol_name):
+                scaf_id = scaf_rep_to_id[scaf_rep]
+                if scaf_id in seen_invalid_scafs:
+                    continue
                 mol2scaf_writer.writerow([mol_id, mol_name, scaf_id])
                 if scaf_id not in seen_scafs:
-                    scaf_hierarchy = scaf_node[1]["hierarchy"]
-                    scaf2scaf_str = _get_sub_scaffolds(
-                        scaffold_graph, scaf_id, scaf_rep, scaf_rep_to_id
-                    )
-                    scaf_row = [
-                        scaf_id,
-                        scaf_rep,
-                        scaf_hierarchy,
-                        scaf2scaf_str,
-                    ]
-                    if include_kekule_smiles:
-                        scaf_row.insert(2, kekule_smiles)
-                    scaf_writer.writerow(scaf_row)
-                    seen_scafs[scaf_id] = True
+                    seen_scafs.add(scaf_id)
+                    scaf_order.append(scaf_id)
+            mol_id += 1
+        scaffold_graph.clear_molecules()
+        f_mol.flush()
+        f_mol2scaf.flush()
     close_file(f_mol)
-    close_file(f_scaf)
     close_file(f_mol2scaf)
 
+    scaf_writer, f_scaf = get_csv_writer(args.o_scaf, odelimeter)
+    scaf_header, include_kekule_smiles = get_scaf_header(
+        scaffold_graph.identifier_type, args.include_kekule_smiles
+    )
+    scaf_writer.writerow(scaf_header)
+    for scaf_id in scaf_order:
+        scaf_rep = scaf_reps[scaf_id]
+        scaf_row = [
+            scaf_id,
+            scaf_rep,
+            scaffold_graph.scaffolds[scaf_rep],
+            _get_sub_scaffolds(scaffold_graph, scaf_id, scaf_rep, scaf_rep_to_id),
+        ]
+        if include_kekule_smiles:
+            scaf_row.insert(2, scaf_kekule_smiles[scaf_id])
+        scaf_writer.writerow(scaf_row)
+    close_file(f_scaf)
+    return scaffold_graph, mol_id
+
 
 def main(args):
     if args.smiles_column == args.name_column:
         raise ValueError(
             "Given smiles_column and name_column cannot be the same. This is because using SMILES as the name can cause issues when input molecules are self-scaffolds and/or scaffolds of another input molecule."
         )
+    if args.stream and args.graph_backend == "compact":
+        raise ValueError(
+            "--stream keeps only the scaffold hierarchy in memory and does not use --graph_backend compact, remove one of the two arguments."
+        )
     args_dict = vars(args)
     logger.info(f"Running generate_scaffolds.py with the following args: {args_dict}")
-    network = CustomHierS.from_smiles_file(
-        file_name=args.i,
-        header=args.iheader,
-        delimiter=args.idelim,
-        smiles_column=args.smiles_column,
-        name_column=args.name_column,
-        ring_cutoff=args.max_rings,  # note that this is counting ring systems, not rings
-        progress=True,
-    )
-    write_outs(
-        network,
-        args.include_kekule_smiles,
-        args.o_mol,
-        args.o_scaf,
-        args.o_mol2scaf,
-        "\t",
-    )
-    logger.info(f"Total number of molecules in graph: {network.num_molecule_nodes}")
+    if args.stream:
+        logger.info(
+            f"Streaming outputs ({args.workers} worker(s), shards of {args.shard_size} molecules)..."
+        )
+        network, n_molecules = write_outs_streaming(args, "\t")
+    elif args.graph_backend == "compact":
+        logger.info(
+            f"Building compact scaffold graph ({args.workers} worker(s), shards of {args.shard_size} molecules)..."
+        )
+        network = build_sharded(args, CompactScaffoldGraph())
+        logger.info(
+            f"Scaffold graph arrays: {network.nbytes / 2**20:.1f} MB ({network.num_scaffold_nodes} scaffolds, {network.num_molecule_nodes} molecules)"
+        )
+    elif args.workers > 1:
+        logger.info(
+            f"Building scaffold graph with {args.workers} workers (shards of {args.shard_size} molecules)..."
+        )
+        network = build_sharded(args, ScaffoldHierarchy())
+    elif is_parquet_file(args.i):
+        # e.g., --o_compound from pubchem_assay_activities.py --output_format parquet
+        # names are read as text, as they would be from a SMI/TSV file
+        cpd_df = read_table(args.i).astype(str)
+        network = CustomHierS.from_dataframe(
+            cpd_df,
+            smiles_column=cpd_df.columns[args.smiles_column],
+            name_column=cpd_df.columns[args.name_column],
+            ring_cutoff=args.max_rings,
+            progress=True,
+            fragment_cache_file=args.fragment_cache,
+        )
+    else:
+        network = CustomHierS.from_smiles_file(
+            file_name=args.i,
+            header=args.iheader,
+            delimiter=args.idelim,
+            smiles_column=args.smiles_column,
+            name_column=args.name_column,
+            ring_cutoff=args.max_rings,  # note that this is counting ring systems, not rings
+            progress=True,
+            fragment_cache_file=args.fragment_cache,
+        )
+    if not args.stream:
+        write_outs(
+            network,
+            args.include_kekule_smiles,
+            args.o_mol,
+            args.o_scaf,
+            args.o_mol2scaf,
+            "\t",
+            args.workers,
+        )
+        n_molecules = network.num_molecule_nodes
+    logger.info(f"Total number of molecules in graph: {n_molecules}")
     logger.info(f"Total number of scaffolds in graph: {network.num_scaffold_nodes}")
     logger.info(
         f"Total number of input molecules filtered (> max_rings): {network.graph["num_filtered"]}"
@@ -252,6 +506,11 @@ def main(args):
     logger.info(
         f"Total number of linear molecules (molecules with no scaffolds) in input: {network.graph["num_linear"]}"
     )
+    n_hash_calls = network.graph.get("num_hash_calls", 0)
+    if n_hash_calls > 0:
+        logger.info(
+            f"Scaffold identifier memo hit rate: {network.graph.get('num_hash_hits', 0) / n_hash_calls:.1%} ({n_hash_calls} lookups)"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Stream a Parquet file (e.g., from pubchem_assay_activities.py --output_format parquet)
+as TSV, in the same format as the TSV outputs (header line, "<NA>" for missing values).
+Used by sh_scripts/db/load_pubchem_tsvs.sh to load Parquet files with \\COPY ... FROM PROGRAM.
+"""
+
+import argparse
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.file_utils import close_file
+
+# keep integer columns with missing values as integers (rather than float)
+ARROW_TO_PANDAS_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+
+def parse_args(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--i",
+        type=str,
+        required=True,
+        default=argparse.SUPPRESS,
+        help="input .parquet file",
+    )
+    parser.add_argument(
+        "--o",
+        type=str,
+        default=None,
+        help="output TSV file. If not given will write to stdout.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=100_000,
+        help="Number of rows to convert at a time (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    parquet_file = pq.ParquetFile(args.i)
+    f = sys.stdout if args.o is None else open(args.o, "w")
+    header = True
+    for batch in parquet_file.iter_batches(batch_size=args.batch_size):
+        df = batch.to_pandas(types_mapper=ARROW_TO_PANDAS_TYPES.get)
+        df.to_csv(
+            f,
+            sep="\t",
+            index=False,
+            header=header,
+            na_rep="<NA>",
+            lineterminator="\r\n",  # as csv.writer (get_csv_writer)
+        )
+        header = False
+    if header:  # empty file
+        f.write("\t".join(parquet_file.schema_arrow.names) + "\r\n")
+    close_file(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a Parquet file to TSV", epilog=""
+    )
+    args = parse_args(parser)
+    main(args)
@@ -6,13 +6,29 @@ This scripts generates a text file with the list of AIDs that are considered
 high-throughput screening (HTS).
 
 Run sh_scripts/mirror_pubchem.sh BEFORE using this script.
+Only the columns needed for filtering are read from bioassays.tsv.gz (in chunks). These columns
+are cached in a Parquet file next to it, so later runs (e.g., with a different --n_compound_thresh)
+do not need to decompress and parse the catalogue again.
 """
 
 import argparse
+import os
 
 import pandas as pd
 
 from utils.custom_logging import get_and_set_logger
+from utils.file_utils import ParquetTableWriter, read_parquet_metadata, read_table
+
+# columns of bioassays.tsv.gz needed to select HTS assays (and their types in the cache)
+BIOASSAY_COLS = {
+    "AID": "int64",
+    "Number of Tested CIDs": "int64",
+    "Outcome Type": "string",
+    "Source Name": "string",
+    "Deposit Date": "int64",
+}
+# based on assays from Badapple 1.0 outcome type can include Confirmatory + Other
+HTS_OUTCOME_TYPES = ["Screening", "Confirmatory", "Other"]
 
 
 def parse_args(parser: argparse.ArgumentParser):
@@ -53,6 +69,24 @@ def parse_args(parser: argparse.ArgumentParser):
         default=None,
         help="If provided, won't include bioassay records which have a deposit date later than the provided date. Date should be provided in format {year}{month}{day}, for example July 4th 2006 would be 20060604. For month and day be sure to include 2 digits (the 4th is 04 not 4, June is 06 not 6, etc).",
     )
+    parser.add_argument(
+        "--cache_file",
+        type=str,
+        default=None,
+        help="(Optional) Parquet file caching the needed columns of bioassays_file. Rebuilt if bioassays_file changed (size or modification time differ from those recorded in the cache). Default: <bioassays_file>.columns.parquet",
+    )
+    parser.add_argument(
+        "--use_cache",
+        help="Read (and write) the cached columns of bioassays_file (see --cache_file)",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100_000,
+        help="Number of rows of bioassays_file to read at a time (default: %(default)s)",
+    )
     parser.add_argument(
         "--log_fname",
         help="File to save logs to. If not given will log to stdout.",
@@ -61,6 +95,70 @@ def parse_args(parser: argparse.ArgumentParser):
     return parser.parse_args()
 
 
+def filter_bioassays(
+    bioassays_df: pd.DataFrame,
+    n_compound_thresh: int,
+    source_names: pd.Series = None,
+    deposit_date_cutoff: int = None,
+) -> pd.DataFrame:
+    # rows with missing values in a filtered column are dropped
+    keep = bioassays_df["Number of Tested CIDs"] >= n_compound_thresh
+    keep &= bioassays_df["Outcome Type"].isin(HTS_OUTCOME_TYPES)
+    if source_names is not None:
+        keep &= bioassays_df["Source Name"].isin(source_names)
+    if deposit_date_cutoff is not None:
+        keep &= bioassays_df["Deposit Date"] <= deposit_date_cutoff
+    return bioassays_df[keep.fillna(False)]
+
+
+def iter_bioassay_chunks(bioassays_file: str, chunk_size: int, cache_file: str = None):
+    # yields chunks of bioassays_file (only BIOASSAY_COLS, typed)
+    # if cache_file is given the chunks are also written to it (made visible once complete)
+    reader = pd.read_csv(
+        bioassays_file,
+        compression="gzip",
+        sep="\t",
+        usecols=list(BIOASSAY_COLS.keys()),
+        dtype={
+            col: "Int64" if col_type == "int64" else col_type
+            for col, col_type in BIOASSAY_COLS.items()
+        },
+        chunksize=chunk_size,
+    )
+    cache_writer = None
+    if cache_file is not None:
+        # (source file stats taken before reading, so a concurrent update invalidates the cache)
+        cache_writer = ParquetTableWriter(
+            cache_file + ".tmp",
+            BIOASSAY_COLS,
+            metadata=source_file_stats(bioassays_file),
+        )
+    for chunk in reader:
+        chunk = chunk[list(BIOASSAY_COLS.keys())]
+        if cache_writer is not None:
+            cache_writer.write_df(chunk)
+        yield chunk
+    if cache_writer is not None:
+        cache_writer.close()
+        os.replace(cache_file + ".tmp", cache_file)
+
+
+def source_file_stats(file_path: str) -> dict[str, str]:
+    # identifies the version of the bioassays file a cache was built from
+    # (a file synced with rsync -t keeps the remote mtime, which can be older than the cache)
+    stat = os.stat(file_path)
+    return {"source_size": str(stat.st_size), "source_mtime_ns": str(stat.st_mtime_ns)}
+
+
+def is_cache_valid(cache_file: str, bioassays_file: str) -> bool:
+    # the cache is valid if it was built from a file of the same size and mtime
+    if not os.path.exists(cache_file):
+        return False
+    metadata = read_parquet_metadata(cache_file)
+    stats = source_file_stats(bioassays_file)
+    return all(metadata.get(key) == value for key, value in stats.items())
+
+
 def main(args):
     logger = get_and_set_logger(args.log_fname)
     if not args.bioassays_file.endswith("bioassays.tsv.gz"):
@@ -71,39 +169,50 @@ def main(args):
         raise ValueError(
             f"Provided data_source_category but not a path to pubchem_data_sources_file."
         )
-    logger.info(f"Reading bioassays.tsv.gz...")
-    bioassays_df = pd.read_csv(args.bioassays_file, compression="gzip", sep="\t")
-    # filter out non-HTS assays
-    logger.info(f"Filtering by N_compounds >= {args.n_compound_thresh}")
-    bioassays_df = bioassays_df[
-        bioassays_df["Number of Tested CIDs"] >= args.n_compound_thresh
-    ]
-    logger.info(f"Filtering by Outcome Type ('Screening', 'Confirmatory', or 'Other')")
-    bioassays_df = bioassays_df[
-        bioassays_df["Outcome Type"].isin(["Screening", "Confirmatory", "Other"])
-    ]  # based on assays from Badapple 1.0 outcome type can include Confirmatory + Other
+    source_names = None
     if len(args.data_source_category) > 0:
-        logger.info(f"Filtering by Data Source Category: {args.data_source_category}")
         data_sources_df = pd.read_csv(args.pubchem_data_sources_file, sep=",")
         data_sources_df = data_sources_df.dropna(subset=["Source Category"])
         # using contains bc often the Source Category contains multiple labels, for example: "Legacy Depositors, NIH Initiatives"
         data_sources_df = data_sources_df[
             data_sources_df["Source Category"].str.contains(args.data_source_category)
         ]
-        bioassays_df = bioassays_df[
-            bioassays_df["Source Name"].isin(data_sources_df["Source Name"])
-        ]
+        source_names = data_sources_df["Source Name"]
+
+    logger.info(f"Filtering by N_compounds >= {args.n_compound_thresh}")
+    logger.info(f"Filtering by Outcome Type ({', '.join(HTS_OUTCOME_TYPES)})")
+    if source_names is not None:
+        logger.info(f"Filtering by Data Source Category: {args.data_source_category}")
     if args.deposit_date_cutoff is not None:
         logger.info(f"Filtering by Date Cutoff: {args.deposit_date_cutoff}")
-        bioassays_df = bioassays_df[
-            bioassays_df["Deposit Date"] <= args.deposit_date_cutoff
-        ]
-    # get and save list of HTS AIDs
-    hts_aids_list = bioassays_df["AID"].tolist()
+
+    cache_file = args.cache_file or args.bioassays_file + ".columns.parquet"
+    if args.use_cache and is_cache_valid(cache_file, args.bioassays_file):
+        logger.info(f"Reading cached bioassay columns from: {cache_file}")
+        chunks = [read_table(cache_file)]
+    else:
+        if args.use_cache and os.path.exists(cache_file):
+            logger.warning(
+                f"Cached bioassay columns ({cache_file}) do not match {args.bioassays_file} (size/modification time changed), rebuilding the cache"
+            )
+        logger.info(f"Reading bioassays.tsv.gz...")
+        chunks = iter_bioassay_chunks(
+            args.bioassays_file,
+            args.chunk_size,
+            cache_file if args.use_cache else None,
+        )
+    hts_aids_list = []
+    for chunk in chunks:
+        hts_df = filter_bioassays(
+            chunk, args.n_compound_thresh, source_names, args.deposit_date_cutoff
+        )
+        hts_aids_list.extend(hts_df["AID"].tolist())
+
+    # save list of HTS AIDs
     with open(args.aid_out_file, "w") as file:
         for aid in hts_aids_list:
             file.write(f"{aid}\n")
-    logger.info(f"Done! Wrote AID list to: {args.aid_out_file}")
+    logger.info(f"Done! Wrote {len(hts_aids_list)} AIDs to: {args.aid_out_file}")
 
 
 if __name__ == "__main__":
@@ -12,14 +12,32 @@ via rsync (see sh_scripts/mirror_pubchem.sh).
 import argparse
 import csv
 import gzip
+import multiprocessing
 import os
+import resource
+import time
 import zipfile
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from typing import Iterator
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 from utils.custom_logging import get_and_set_logger
-from utils.file_utils import close_file, get_csv_writer, read_aid_file
+from utils.file_utils import (
+    ParquetTableWriter,
+    TsvTableWriter,
+    file_crc32,
+    read_aid_file,
+)
+from utils.id_set import CompactIdSet, id_keys, pair_keys
+
+# output columns (and their types for --output_format parquet)
+COMPOUND_COLS = {"CID": "int64", "ISOMERIC_SMILES": "string"}
+SID2CID_COLS = {"SID": "int64", "CID": "int64"}
+ASSAYSTATS_COLS = {"AID": "int32", "SID": "int64", "ACTIVITY_OUTCOME": "int8"}
 
 
 def parse_args(parser: argparse.ArgumentParser):
@@ -58,17 +76,47 @@ def parse_args(parser: argparse.ArgumentParser):
         default=argparse.SUPPRESS,
         help="output TSV file which maps between assay id (AID), substance id (SID), and activity outcome",
     )
+    parser.add_argument(
+        "--output_format",
+        choices=["tsv", "parquet"],
+        default="tsv",
+        help="Format of output files. Parquet files are typed (int32 AID, int64 SID/CID, int8 outcome) and compressed, output paths should end with .parquet so downstream steps recognize them (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--manifest_file",
+        type=str,
+        default=None,
+        help="(Optional) TSV file recording each completed AID with its row counts and the size/CRC32 of the outputs (--output_format tsv only). Default: <o_assaystats>.manifest.tsv",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Resume an interrupted run: outputs are verified against and truncated to the last AID in the manifest, AIDs in the manifest are skipped, and deduplication continues from the existing outputs. Without --resume existing outputs (and manifest) are overwritten.",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
     parser.add_argument(
         "--log_fname",
         help="File to save logs to. If not given will log to stdout.",
         default=None,
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. If > 1, .zip files are read and parsed in parallel (grouped as with --process_by_batch) while the main process writes the outputs in the same order as a serial --process_by_batch run.",
+    )
     parser.add_argument(
         "--process_by_batch",
-        help="Process given AID file by .zip rather than by AID. Faster, but requires more memory (process will be killed if OOM occurs).",
+        help="Process given AID file by .zip rather than by AID. Faster, but requires more memory (process will be killed if OOM occurs, see --max_memory_mb).",
         action=argparse.BooleanOptionalAction,
         default=False,
     )
+    parser.add_argument(
+        "--max_memory_mb",
+        type=int,
+        default=0,
+        help="(Optional) Memory budget (MB) for assay data held at once with --process_by_batch. If > 0, assays in a .zip are read one at a time and written out whenever the budget is reached. Output is the same as without a budget (default: %(default)s, no budget)",
+    )
     return parser.parse_args()
 
 
@@ -87,135 +135,448 @@ def get_zip_filename(
     return f"{lower}_{upper}.zip"
 
 
-def find_data_start_row(file) -> int:
-    with gzip.open(file, "rt") as decompressed_file:  # Decompress the file
-        reader = csv.reader(decompressed_file)
-        for i, row in enumerate(reader):
-            try:
-                if int(row[0]) > 0:
-                    return i
-            except ValueError:
-                continue
-    return None
+class _PrefixedTextStream:
+    """Read-only text stream which serves prefix before the remainder of stream.
+    Used to hand pd.read_csv the header line + the data rows, without the metadata rows in between."""
 
+    def __init__(self, prefix: str, stream):
+        self.prefix = prefix
+        self.stream = stream
 
-def read_csv_files(
+    def read(self, size: int = -1) -> str:
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            out, self.prefix = self.prefix + self.stream.read(), ""
+        else:
+            out, self.prefix = self.prefix[:size], self.prefix[size:]
+        return out
+
+    def readline(self) -> str:
+        if not self.prefix:
+            return self.stream.readline()
+        end = self.prefix.find("\n") + 1
+        if end == 0:
+            out, self.prefix = self.prefix + self.stream.readline(), ""
+        else:
+            out, self.prefix = self.prefix[:end], self.prefix[end:]
+        return out
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+
+def _read_csv_record(stream) -> str:
+    # read one CSV record (a quoted field may span multiple lines), "" at EOF
+    record = stream.readline()
+    while record.count('"') % 2 == 1:
+        line = stream.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def _is_data_record(record: str) -> bool:
+    # data rows start with PUBCHEM_RESULT_TAG (a positive int), metadata rows
+    # (RESULT_TYPE, RESULT_DESCR, ...) with a label
+    row = next(csv.reader([record]), [])
+    try:
+        return int(row[0]) > 0
+    except (ValueError, IndexError):
+        return False
+
+
+def read_pubchem_csv(file, col_types: dict) -> pd.DataFrame:
+    """Read a gzipped PubChem assay CSV file in a single pass.
+    PubChem csv files have a variable number of metadata rows between the header and the data,
+    these are skipped while streaming (rather than decompressing the file once to locate the data
+    and a second time to parse it).
+    """
+    with gzip.open(file, "rt", encoding="utf-8", newline="") as stream:
+        header = _read_csv_record(stream)
+        record = _read_csv_record(stream)
+        while record and not _is_data_record(record):
+            record = _read_csv_record(stream)
+        return pd.read_csv(
+            _PrefixedTextStream(header + record, stream),
+            delimiter=",",
+            header=0,
+            usecols=list(col_types.keys()),
+            dtype=col_types,
+        )
+
+
+class ZipFileCache:
+    """LRU cache of open ZipFile handles, so that consecutive AIDs from the same .zip file
+    do not re-open it (and re-parse its central directory) every time."""
+
+    def __init__(self, max_open: int = 8):
+        self.max_open = max_open
+        self.handles = OrderedDict()
+
+    def get(self, zip_filepath: str) -> zipfile.ZipFile:
+        if zip_filepath in self.handles:
+            self.handles.move_to_end(zip_filepath)
+            return self.handles[zip_filepath]
+        if len(self.handles) >= self.max_open:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        zip_ref = zipfile.ZipFile(zip_filepath, "r")
+        self.handles[zip_filepath] = zip_ref
+        return zip_ref
+
+    def close(self):
+        for zip_ref in self.handles.values():
+            zip_ref.close()
+        self.handles.clear()
+
+
+def find_missing_aids(assay_zip_dir: str, assay_ids: list[int]) -> list[int]:
+    # AIDs without a <aid>.csv.gz file in their .zip file (only reads the .zip directories)
+    missing_aids = []
+    for zip_filename, zip_assay_ids in group_aids_by_zip(assay_ids).items():
+        zip_filepath = os.path.join(assay_zip_dir, zip_filename)
+        if not os.path.exists(zip_filepath):
+            missing_aids.extend(zip_assay_ids)
+            continue
+        zip_dirname = os.path.splitext(zip_filename)[0]
+        with zipfile.ZipFile(zip_filepath, "r") as zip_ref:
+            members = set(zip_ref.namelist())
+        missing_aids.extend(
+            aid for aid in zip_assay_ids if f"{zip_dirname}/{aid}.csv.gz" not in members
+        )
+    return missing_aids
+
+
+def iter_csv_files(
     zip_filepath: str,
     assay_ids: list[int],
     col_types: dict,
     logger,
-) -> list[pd.DataFrame]:
+    zip_cache: ZipFileCache = None,
+) -> Iterator[pd.DataFrame]:
+    # yields the assays in the .zip file one at a time
+    # if zip_cache is given the .zip file is opened through (and left open in) the cache
     zip_filename = os.path.splitext(os.path.basename(zip_filepath))[0]
-    dfs = []
-    cols = list(col_types.keys())
     try:
-        with zipfile.ZipFile(zip_filepath, "r") as zip_ref:
+        if zip_cache is None:
+            zip_context = zipfile.ZipFile(zip_filepath, "r")
+        else:
+            zip_context = nullcontext(zip_cache.get(zip_filepath))
+        with zip_context as zip_ref:
             for aid in assay_ids:
                 csv_filename = f"{zip_filename}/{aid}.csv.gz"
                 with zip_ref.open(csv_filename, "r") as file:
-                    # pubchem csv files have a variable number of metadata headers
-                    start_row = find_data_start_row(file)
-                    # reopen since find_data_start_row consumes the file
-                    with zip_ref.open(csv_filename, "r") as file:
-                        df = pd.read_csv(
-                            file,
-                            compression="gzip",
-                            skiprows=range(1, start_row),
-                            delimiter=",",
-                            header=0,
-                            usecols=cols,
-                            dtype=col_types,
-                        )
-                        dfs.append(df)
+                    yield read_pubchem_csv(file, col_types)
     except Exception as e:
         logger.info(f"Assay id(s): {assay_ids}")
         logger.info(f".zip file: {zip_filepath}")
         raise e
-    return dfs
+
+
+def read_csv_files(
+    zip_filepath: str,
+    assay_ids: list[int],
+    col_types: dict,
+    logger,
+) -> list[pd.DataFrame]:
+    return list(iter_csv_files(zip_filepath, assay_ids, col_types, logger))
+
+
+ACTIVITY_CODES = {
+    "Inactive": 1,
+    "Active": 2,
+    "Inconclusive": 3,
+    "Unspecified": 4,
+    "Probe": 5,
+}
+NA_ACTIVITY_CODE = 4  # missing outcome is treated as "Unspecified"
 
 
 def activity_to_code(activity_str: str) -> int:
-    if activity_str == "Inactive":
-        return 1
-    elif activity_str == "Active":
-        return 2
-    elif activity_str == "Inconclusive":
-        return 3
-    elif activity_str == "Unspecified" or pd.isna(activity_str):
-        return 4
-    elif activity_str == "Probe":
-        return 5
+    if pd.isna(activity_str):
+        return NA_ACTIVITY_CODE
+    elif activity_str in ACTIVITY_CODES:
+        return ACTIVITY_CODES[activity_str]
     else:
         raise ValueError("Unrecognized activity_str:", activity_str)
 
 
+def activity_to_codes(activity_strs: pd.Series) -> pd.Series:
+    # vectorized activity_to_code(): outcomes are categorical (few distinct values),
+    # so only the categories are looked up and codes are gathered in one operation
+    activity_strs = activity_strs.astype("category")
+    categories = activity_strs.cat.categories
+    unrecognized = [c for c in categories if c not in ACTIVITY_CODES]
+    if len(unrecognized) > 0:
+        raise ValueError("Unrecognized activity_str:", unrecognized)
+    # (missing values have category code -1 => last entry)
+    lookup = np.array(
+        [ACTIVITY_CODES[c] for c in categories] + [NA_ACTIVITY_CODE], dtype=np.int8
+    )
+    return pd.Series(
+        lookup[activity_strs.cat.codes.to_numpy()],
+        index=activity_strs.index,
+        name=activity_strs.name,
+    )
+
+
+def prepare_assay_df(df: pd.DataFrame, assay_id: int) -> pd.DataFrame:
+    # add AID column and convert activity outcomes to codes
+    df["AID"] = assay_id
+    df["PUBCHEM_ACTIVITY_OUTCOME"] = activity_to_codes(df["PUBCHEM_ACTIVITY_OUTCOME"])
+    return df
+
+
+def iter_assay_dfs(
+    zip_filepath: str,
+    assay_ids: list[int],
+    col_types: dict,
+    logger,
+    zip_cache: ZipFileCache = None,
+) -> Iterator[pd.DataFrame]:
+    # read assays from .zip file (one at a time) and prepare them for write_dfs()
+    assay_dfs = iter_csv_files(zip_filepath, assay_ids, col_types, logger, zip_cache)
+    for aid, df in zip(assay_ids, assay_dfs):
+        yield prepare_assay_df(df, aid)
+
+
+def read_assay_dfs(
+    zip_filepath: str,
+    assay_ids: list[int],
+    col_types: dict,
+    logger,
+    zip_cache: ZipFileCache = None,
+) -> list[pd.DataFrame]:
+    return list(iter_assay_dfs(zip_filepath, assay_ids, col_types, logger, zip_cache))
+
+
+class AidManifest:
+    """
+    Manifest of completed AIDs (TSV, one row per AID), used to resume interrupted runs.
+    After each AID the number of rows written for it and the size (bytes) and CRC32 of each
+    output file are recorded, so that a resumed run can verify the outputs, truncate them to
+    the last completed AID, and skip the completed AIDs.
+    """
+
+    OUTPUTS = ["COMPOUND", "SID2CID", "ASSAYSTATS"]  # in order of the writers
+    COLS = (
+        ["AID"]
+        + [f"N_{name}" for name in OUTPUTS]
+        + [f"{name}_{x}" for name in OUTPUTS for x in ["BYTES", "CRC32"]]
+    )
+
+    def __init__(
+        self, file_path: str, writers: list[TsvTableWriter], append: bool = False
+    ):
+        self.f = open(file_path, "a" if append else "w")
+        self.writers = writers
+        if not append:
+            self.f.write("\t".join(AidManifest.COLS) + "\n")
+            self.f.flush()
+
+    def record(self, aid: int, n_rows: list[int]):
+        # outputs are flushed first, so the manifest never refers to unwritten rows
+        for writer in self.writers:
+            writer.flush()
+        fields = [aid] + list(n_rows)
+        for writer in self.writers:
+            fields += [writer.n_bytes, writer.crc32]
+        self.f.write("\t".join(str(int(x)) for x in fields) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    @staticmethod
+    def read(file_path: str) -> pd.DataFrame:
+        """Read completed entries, dropping a partially written last line (and truncating the file to match)."""
+        with open(file_path, "r") as f:
+            lines = f.readlines()
+        if len(lines) == 0 or lines[0].rstrip("\n").split("\t") != AidManifest.COLS:
+            raise ValueError(f"Not a manifest file: {file_path}")
+        n_complete = len(lines)
+        if not lines[-1].endswith("\n"):
+            n_complete -= 1
+            os.truncate(file_path, sum(len(line) for line in lines[:n_complete]))
+        rows = [[int(x) for x in line.split("\t")] for line in lines[1:n_complete]]
+        return pd.DataFrame(rows, columns=AidManifest.COLS, dtype="int64")
+
+
+def rebuild_written_ids(
+    o_compound: str, o_sid2cid: str, chunk_size: int = 1_000_000
+) -> tuple[CompactIdSet, CompactIdSet, int, int]:
+    # dedup state (see write_dfs()) of existing outputs, read in chunks
+    # also returns the number of rows of o_compound / o_sid2cid
+    written_sid2cid_pairs = CompactIdSet()
+    written_cids = CompactIdSet()
+    n_sid2cid_rows, n_compound_rows = 0, 0
+    for chunk in pd.read_csv(o_sid2cid, sep="\t", dtype="Int64", chunksize=chunk_size):
+        written_sid2cid_pairs.add_new(pair_keys(chunk["SID"], chunk["CID"]))
+        n_sid2cid_rows += len(chunk)
+    for chunk in pd.read_csv(
+        o_compound,
+        sep="\t",
+        usecols=["CID"],
+        dtype={"CID": "Int64"},
+        chunksize=chunk_size,
+    ):
+        written_cids.add_new(id_keys(chunk["CID"]))
+        n_compound_rows += len(chunk)
+    return written_sid2cid_pairs, written_cids, n_compound_rows, n_sid2cid_rows
+
+
+def resume_outputs(
+    output_files: list[str], manifest: pd.DataFrame, logger
+) -> tuple[CompactIdSet, CompactIdSet, list[int]]:
+    """
+    Verify output_files (compound, sid2cid, assaystats) against the last manifest entry,
+    truncate them to it (dropping rows of a partially written AID), and rebuild the dedup state.
+    Returns the written SID-CID pairs, written CIDs, and CRC32 of each output file.
+    """
+    last = manifest.iloc[-1]
+    crcs = []
+    for file_path, name in zip(output_files, AidManifest.OUTPUTS):
+        n_bytes, crc32 = int(last[f"{name}_BYTES"]), int(last[f"{name}_CRC32"])
+        if not os.path.exists(file_path):
+            raise ValueError(f"Cannot resume, output file not found: {file_path}")
+        if file_crc32(file_path, n_bytes) != crc32:
+            raise ValueError(
+                f"Cannot resume, {file_path} does not match the manifest (CRC32 mismatch in first {n_bytes} bytes)"
+            )
+        n_extra = os.path.getsize(file_path) - n_bytes
+        if n_extra > 0:
+            logger.info(
+                f"Truncating {n_extra} bytes written after AID {last['AID']} from {file_path}"
+            )
+            os.truncate(file_path, n_bytes)
+        crcs.append(crc32)
+    written_sid2cid_pairs, written_cids, n_compound_rows, n_sid2cid_rows = (
+        rebuild_written_ids(output_files[0], output_files[1])
+    )
+    if (
+        n_compound_rows != manifest["N_COMPOUND"].sum()
+        or n_sid2cid_rows != manifest["N_SID2CID"].sum()
+    ):
+        raise ValueError(
+            f"Cannot resume, row counts of {output_files[0]} / {output_files[1]} do not match the manifest"
+        )
+    return written_sid2cid_pairs, written_cids, crcs
+
+
 def write_dfs(
     assay_dfs: list[pd.DataFrame],
     assay_ids: list[int],
-    compounds_writer,
-    sid2cid_writer,
-    astats_writer,
-    written_sid2cid_pairs: set,
-    written_cids: set,
+    compounds_writer: TsvTableWriter | ParquetTableWriter,
+    sid2cid_writer: TsvTableWriter | ParquetTableWriter,
+    astats_writer: TsvTableWriter | ParquetTableWriter,
+    written_sid2cid_pairs: CompactIdSet,
+    written_cids: CompactIdSet,
+    manifest: AidManifest = None,
 ):
+    # assay_dfs should come from read_assay_dfs()
+    # if manifest is given each AID is recorded once its rows are written
     assert len(assay_dfs) == len(assay_ids)
-    for assay_id, df in zip(assay_ids, assay_dfs):
-        df["AID"] = assay_id
-        df["PUBCHEM_ACTIVITY_OUTCOME"] = df["PUBCHEM_ACTIVITY_OUTCOME"].map(
-            activity_to_code
-        )
+    for aid, df in zip(assay_ids, assay_dfs):
         compound_rows = df[["PUBCHEM_CID", "PUBCHEM_EXT_DATASOURCE_SMILES"]]
         compound_rows = (
             compound_rows.drop_duplicates()
         )  # there can be multiple CIDs/AID (same CID, different SID)
-        compound_rows = compound_rows.values
-        sid2cid_rows = df[["PUBCHEM_SID", "PUBCHEM_CID"]].values
-        astats_rows = df[["AID", "PUBCHEM_SID", "PUBCHEM_ACTIVITY_OUTCOME"]].values
+        sid2cid_rows = df[["PUBCHEM_SID", "PUBCHEM_CID"]]
+        astats_rows = df[["AID", "PUBCHEM_SID", "PUBCHEM_ACTIVITY_OUTCOME"]]
 
-        # filter out duplicates
-        new_sid2cid_rows = [
-            row for row in sid2cid_rows if tuple(row) not in written_sid2cid_pairs
-        ]
-        # row[0] = CID
-        new_cid_rows = [row for row in compound_rows if row[0] not in written_cids]
-        written_sid2cid_pairs.update(tuple(row) for row in new_sid2cid_rows)
-        written_cids.update(row[0] for row in new_cid_rows)
+        # filter out rows written for previous assays (vectorized, see CompactIdSet)
+        # (as before, repeated rows within one assay are all written)
+        is_new_pair = written_sid2cid_pairs.add_unseen(
+            pair_keys(sid2cid_rows["PUBCHEM_SID"], sid2cid_rows["PUBCHEM_CID"])
+        )
+        is_new_cid = written_cids.add_unseen(id_keys(compound_rows["PUBCHEM_CID"]))
 
         # write to files
-        compounds_writer.writerows(new_cid_rows)
-        sid2cid_writer.writerows(new_sid2cid_rows)
-        astats_writer.writerows(astats_rows)
+        compounds_writer.write_df(compound_rows[is_new_cid])
+        sid2cid_writer.write_df(sid2cid_rows[is_new_pair])
+        astats_writer.write_df(astats_rows)
+        if manifest is not None:
+            manifest.record(
+                aid, [is_new_cid.sum(), is_new_pair.sum(), len(astats_rows)]
+            )
+
+
+def group_aids_by_zip(assay_ids: list[int]) -> dict[str, list[int]]:
+    # .zip filename -> AIDs in that file (in order of first appearance)
+    zip2aids = {}
+    for aid in assay_ids:
+        zip_filename = get_zip_filename(aid)
+        zip2aids[zip_filename] = zip2aids.get(zip_filename, []) + [aid]
+    return zip2aids
 
 
 def batch_process(
     args,
     assay_ids: list[int],
     col_types: list[str],
-    compounds_writer,
-    sid2cid_writer,
-    astats_writer,
-    written_sid2cid_pairs: set,
-    written_cids: set,
+    compounds_writer: TsvTableWriter | ParquetTableWriter,
+    sid2cid_writer: TsvTableWriter | ParquetTableWriter,
+    astats_writer: TsvTableWriter | ParquetTableWriter,
+    written_sid2cid_pairs: CompactIdSet,
+    written_cids: CompactIdSet,
+    manifest: AidManifest,
     logger,
 ):
     # process assays by .zip file
     # faster but more demanding memory-wise
-    zip2aids = {}
-    for aid in assay_ids:
-        zip_filename = get_zip_filename(aid)
-        zip2aids[zip_filename] = zip2aids.get(zip_filename, []) + [aid]
-
+    # if args.max_memory_mb > 0, assays are read one at a time and written out whenever
+    # the assays held in memory exceed the budget (rather than holding a whole .zip at once)
+    max_bytes = args.max_memory_mb * 2**20 if args.max_memory_mb > 0 else None
+    zip2aids = group_aids_by_zip(assay_ids)
     for zip_filename, zip_assay_ids in tqdm(zip2aids.items()):
         zip_filepath = os.path.join(args.assay_zip_dir, zip_filename)
-        assay_dfs = read_csv_files(zip_filepath, zip_assay_ids, col_types, logger)
+        if max_bytes is None:
+            assay_dfs = read_assay_dfs(zip_filepath, zip_assay_ids, col_types, logger)
+            write_dfs(
+                assay_dfs,
+                zip_assay_ids,
+                compounds_writer,
+                sid2cid_writer,
+                astats_writer,
+                written_sid2cid_pairs,
+                written_cids,
+                manifest,
+            )
+            continue
+        assay_dfs, batch_assay_ids, batch_bytes = [], [], 0
+        for aid, df in zip(
+            zip_assay_ids,
+            iter_assay_dfs(zip_filepath, zip_assay_ids, col_types, logger),
+        ):
+            assay_dfs.append(df)
+            batch_assay_ids.append(aid)
+            batch_bytes += df.memory_usage(deep=True).sum()
+            if batch_bytes >= max_bytes:
+                logger.debug(
+                    f"Flushing {len(assay_dfs)} assays ({batch_bytes / 2**20:.1f} MB) from {zip_filename}"
+                )
+                write_dfs(
+                    assay_dfs,
+                    batch_assay_ids,
+                    compounds_writer,
+                    sid2cid_writer,
+                    astats_writer,
+                    written_sid2cid_pairs,
+                    written_cids,
+                    manifest,
+                )
+                assay_dfs, batch_assay_ids, batch_bytes = [], [], 0
         write_dfs(
             assay_dfs,
-            zip_assay_ids,
+            batch_assay_ids,
             compounds_writer,
             sid2cid_writer,
             astats_writer,
             written_sid2cid_pairs,
             written_cids,
+            manifest,
         )
 
 
@@ -223,19 +584,22 @@ def single_process(
     args,
     assay_ids: list[int],
     col_types: list[str],
-    compounds_writer,
-    sid2cid_writer,
-    astats_writer,
-    written_sid2cid_pairs: set,
-    written_cids: set,
+    compounds_writer: TsvTableWriter | ParquetTableWriter,
+    sid2cid_writer: TsvTableWriter | ParquetTableWriter,
+    astats_writer: TsvTableWriter | ParquetTableWriter,
+    written_sid2cid_pairs: CompactIdSet,
+    written_cids: CompactIdSet,
+    manifest: AidManifest,
     logger,
 ):
     # process assays by AID, one at a time
+    # (.zip files are kept open across consecutive AIDs, see ZipFileCache)
+    zip_cache = ZipFileCache()
     for aid in tqdm(assay_ids):
         zip_filename = get_zip_filename(aid)
         zip_filepath = os.path.join(args.assay_zip_dir, zip_filename)
         # singleton list
-        assay_dfs = read_csv_files(zip_filepath, [aid], col_types, logger)
+        assay_dfs = read_assay_dfs(zip_filepath, [aid], col_types, logger, zip_cache)
         write_dfs(
             assay_dfs,
             [aid],
@@ -244,39 +608,159 @@ def single_process(
             astats_writer,
             written_sid2cid_pairs,
             written_cids,
+            manifest,
         )
+    zip_cache.close()
+
+
+def _init_worker(log_fname):
+    global logger
+    logger = get_and_set_logger(log_fname)
+
+
+def _read_zip_worker(zip_filepath: str, zip_assay_ids: list[int], col_types: dict):
+    return read_assay_dfs(zip_filepath, zip_assay_ids, col_types, logger)
+
+
+def parallel_process(
+    args,
+    assay_ids: list[int],
+    col_types: list[str],
+    compounds_writer: TsvTableWriter | ParquetTableWriter,
+    sid2cid_writer: TsvTableWriter | ParquetTableWriter,
+    astats_writer: TsvTableWriter | ParquetTableWriter,
+    written_sid2cid_pairs: CompactIdSet,
+    written_cids: CompactIdSet,
+    manifest: AidManifest,
+    logger,
+):
+    # process assays by .zip file, reading/parsing .zip files with a pool of workers
+    # results are written (and deduplicated) by this process in the same order as batch_process()
+    zip2aids = group_aids_by_zip(assay_ids)
+    tasks = iter(zip2aids.items())
+    # bound the number of parsed .zip files held in memory
+    max_pending = 2 * args.workers
+    with multiprocessing.Pool(
+        args.workers, initializer=_init_worker, initargs=(args.log_fname,)
+    ) as pool:
+        pending = deque()
+
+        def submit_next():
+            task = next(tasks, None)
+            if task is not None:
+                zip_filename, zip_assay_ids = task
+                zip_filepath = os.path.join(args.assay_zip_dir, zip_filename)
+                pending.append(
+                    (
+                        zip_assay_ids,
+                        pool.apply_async(
+                            _read_zip_worker, (zip_filepath, zip_assay_ids, col_types)
+                        ),
+                    )
+                )
+
+        for _ in range(max_pending):
+            submit_next()
+        with tqdm(total=len(zip2aids)) as pbar:
+            while pending:
+                zip_assay_ids, result = pending.popleft()
+                assay_dfs = result.get()
+                submit_next()
+                write_dfs(
+                    assay_dfs,
+                    zip_assay_ids,
+                    compounds_writer,
+                    sid2cid_writer,
+                    astats_writer,
+                    written_sid2cid_pairs,
+                    written_cids,
+                    manifest,
+                )
+                pbar.update(1)
 
 
 def main(args):
+    t0 = time.time()
     logger = get_and_set_logger(args.log_fname)
     assay_ids = read_aid_file(args.aid_file)
+    missing_aids = find_missing_aids(args.assay_zip_dir, assay_ids)
+    if len(missing_aids) > 0:
+        raise ValueError(
+            f"{len(missing_aids)} AID(s) not found in {args.assay_zip_dir}: {missing_aids}"
+        )
 
     # keep track of already written SID-CID pairs and written CIDs
-    written_sid2cid_pairs = set()
-    written_cids = set()
+    written_sid2cid_pairs = CompactIdSet()
+    written_cids = CompactIdSet()
 
     # create writers
-    existed_prev_cpd = os.path.exists(args.o_compound)
-    existed_prev_sid2cid = os.path.exists(args.o_sid2cid)
-    existed_prev_astats = os.path.exists(args.o_assaystats)
-    compounds_writer, f_compounds = get_csv_writer(args.o_compound, "\t")
-    sid2cid_writer, f_sid2cid = get_csv_writer(args.o_sid2cid, "\t")
-    astats_writer, f_astats = get_csv_writer(args.o_assaystats, "\t")
-    if not existed_prev_cpd:  # if exists then assume we're appending
-        compounds_writer.writerow(["CID", "ISOMERIC_SMILES"])
-    if not existed_prev_sid2cid:
-        sid2cid_writer.writerow(["SID", "CID"])
-    if not existed_prev_astats:
-        astats_writer.writerow(["AID", "SID", "ACTIVITY_OUTCOME"])
+    manifest = None
+    if args.output_format == "parquet":
+        if args.resume:
+            raise ValueError("--resume is only supported with --output_format tsv")
+        compounds_writer = ParquetTableWriter(args.o_compound, COMPOUND_COLS)
+        sid2cid_writer = ParquetTableWriter(args.o_sid2cid, SID2CID_COLS)
+        astats_writer = ParquetTableWriter(args.o_assaystats, ASSAYSTATS_COLS)
+    else:
+        outputs = [
+            (args.o_compound, COMPOUND_COLS),
+            (args.o_sid2cid, SID2CID_COLS),
+            (args.o_assaystats, ASSAYSTATS_COLS),
+        ]
+        manifest_file = args.manifest_file or args.o_assaystats + ".manifest.tsv"
+        completed = None
+        if args.resume and os.path.exists(manifest_file):
+            completed = AidManifest.read(manifest_file)
+        resuming = completed is not None and len(completed) > 0
+        if resuming:
+            logger.info(
+                f"Resuming from {manifest_file} ({len(completed)} AIDs completed), rebuilding dedup state..."
+            )
+            written_sid2cid_pairs, written_cids, crcs = resume_outputs(
+                [file_path for file_path, _ in outputs], completed, logger
+            )
+            completed_aids = set(completed["AID"])
+            assay_ids = [aid for aid in assay_ids if aid not in completed_aids]
+            logger.info(f"{len(assay_ids)} AIDs remaining")
+            compounds_writer, sid2cid_writer, astats_writer = [
+                TsvTableWriter(file_path, append=True, crc32=crc32)
+                for (file_path, _), crc32 in zip(outputs, crcs)
+            ]
+        else:
+            if args.resume:
+                logger.info(f"No completed AIDs in {manifest_file}, starting over")
+            compounds_writer, sid2cid_writer, astats_writer = [
+                TsvTableWriter(file_path, list(cols.keys()))
+                for file_path, cols in outputs
+            ]
+        manifest = AidManifest(
+            manifest_file,
+            [compounds_writer, sid2cid_writer, astats_writer],
+            append=resuming,
+        )
 
     # COL_TYPES = columns required for our output files
     COL_TYPES = {
         "PUBCHEM_SID": "Int64",
         "PUBCHEM_CID": "Int64",
         "PUBCHEM_EXT_DATASOURCE_SMILES": str,
-        "PUBCHEM_ACTIVITY_OUTCOME": str,
+        "PUBCHEM_ACTIVITY_OUTCOME": "category",  # see activity_to_codes()
     }
-    if args.process_by_batch:
+    if args.workers > 1:
+        logger.info(f"Processing AID files (by .zip, {args.workers} workers)...")
+        parallel_process(
+            args,
+            assay_ids,
+            COL_TYPES,
+            compounds_writer,
+            sid2cid_writer,
+            astats_writer,
+            written_sid2cid_pairs,
+            written_cids,
+            manifest,
+            logger,
+        )
+    elif args.process_by_batch:
         logger.info("Processing AID files (by .zip)...")
         batch_process(
             args,
@@ -287,6 +771,7 @@ def main(args):
             astats_writer,
             written_sid2cid_pairs,
             written_cids,
+            manifest,
             logger,
         )
     else:
@@ -300,13 +785,21 @@ def main(args):
             astats_writer,
             written_sid2cid_pairs,
             written_cids,
+            manifest,
             logger,
         )
 
-    close_file(f_compounds)
-    close_file(f_sid2cid)
-    close_file(f_astats)
-    logger.info("Done!")
+    compounds_writer.close()
+    sid2cid_writer.close()
+    astats_writer.close()
+    if manifest is not None:
+        manifest.close()
+    logger.info(
+        f"Wrote {len(written_cids)} distinct compounds, {len(written_sid2cid_pairs)} distinct SID-CID pairs (dedup state: {(written_cids.nbytes + written_sid2cid_pairs.nbytes) / 2**20:.1f} MB)"
+    )
+    logger.info(
+        f"Done! (elapsed time: {time.time() - t0:.1f}s, peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB)"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+In-memory (NumPy) engine for computing compound and scaffold assay statistics
+directly from the pipeline output files (pubchem_assay_activities.py + generate_scaffolds.py),
+without needing the Postgres DB to be loaded and indexed first.
+Statistics are intended to be identical to those computed by annotate_db_assaystats.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils.file_utils import read_table
+
+ACTIVE_CODES = (2, 5)
+
+COMPOUND_STAT_COLS = [
+    "nsub_total",
+    "nsub_tested",
+    "nsub_active",
+    "nass_tested",
+    "nass_active",
+    "nsam_tested",
+    "nsam_active",
+]
+
+SCAFFOLD_STAT_COLS = [
+    "ncpd_total",
+    "ncpd_tested",
+    "ncpd_active",
+] + COMPOUND_STAT_COLS
+
+
+def read_activity_tsv(file_path: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # output of pubchem_assay_activities.py (--o_assaystats), TSV or Parquet
+    df = read_table(
+        file_path,
+        usecols=["AID", "SID", "ACTIVITY_OUTCOME"],
+        dtype={"AID": "Int64", "SID": "Int64", "ACTIVITY_OUTCOME": "Int64"},
+    )
+    # rows without AID/SID can never be joined to in the DB
+    df = df.dropna(subset=["AID", "SID"])
+    aids = df["AID"].to_numpy(dtype=np.int32)
+    sids = df["SID"].to_numpy(dtype=np.int64)
+    outcomes = df["ACTIVITY_OUTCOME"].fillna(0).to_numpy(dtype=np.int8)
+    return aids, sids, outcomes
+
+
+def read_sub2cpd_tsv(file_path: str) -> tuple[np.ndarray, np.ndarray]:
+    # output of pubchem_assay_activities.py (--o_sid2cid), TSV or Parquet
+    df = read_table(
+        file_path, usecols=["SID", "CID"], dtype={"SID": "Int64", "CID": "Int64"}
+    )
+    # mirror load_pubchem_tsvs.sh: drop '<NA>' CIDs and keep one CID per SID
+    df = df.dropna().sort_values(["SID", "CID"]).drop_duplicates(subset="SID")
+    return df["SID"].to_numpy(dtype=np.int64), df["CID"].to_numpy(dtype=np.int64)
+
+
+def read_compound_tsv(file_path: str) -> np.ndarray:
+    # output of generate_scaffolds.py (--o_mol), mol_name is the CID
+    df = pd.read_csv(
+        file_path, sep="\t", usecols=["mol_name"], dtype={"mol_name": "Int64"}
+    )
+    return df["mol_name"].dropna().to_numpy(dtype=np.int64)
+
+
+def read_scaf2cpd_tsv(file_path: str) -> tuple[np.ndarray, np.ndarray]:
+    # output of generate_scaffolds.py (--o_mol2scaf), mol_name is the CID
+    df = pd.read_csv(
+        file_path,
+        sep="\t",
+        usecols=["mol_name", "scaffold_id"],
+        dtype={"mol_name": "Int64", "scaffold_id": "Int64"},
+    )
+    df = df.dropna()
+    return df["scaffold_id"].to_numpy(dtype=np.int64), df["mol_name"].to_numpy(
+        dtype=np.int64
+    )
+
+
+def _count_distinct(
+    groups: np.ndarray, values: np.ndarray, n_groups: int
+) -> np.ndarray:
+    """Number of distinct values per group (groups are dense indices in [0, n_groups))."""
+    if len(values) == 0:
+        return np.zeros(n_groups, dtype=np.int64)
+    base = np.int64(values.max()) + 1
+    keys = np.unique(groups.astype(np.int64) * base + values)
+    return np.bincount(keys // base, minlength=n_groups)
+
+
+def _expand_csr(indptr: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """For each entry in rows, enumerate the CSR positions belonging to that row.
+    Returns (index into rows, CSR position) for every expanded element."""
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    row_rep = np.repeat(np.arange(len(rows)), lens)
+    offsets = np.arange(len(row_rep)) - np.repeat(np.cumsum(lens) - lens, lens)
+    return row_rep, starts[row_rep] + offsets
+
+
+class AssayStatsEngine:
+    """
+    Columnar store of the activity, sub2cpd and scaf2cpd relations as integer arrays.
+    Compounds and scaffolds are interned to dense indices so that all group-bys can be
+    done with np.bincount/np.unique.
+    """
+
+    def __init__(
+        self,
+        activity_aids: np.ndarray,
+        activity_sids: np.ndarray,
+        activity_outcomes: np.ndarray,
+        sub2cpd_sids: np.ndarray,
+        sub2cpd_cids: np.ndarray,
+        compound_cids: np.ndarray,
+        scaf2cpd_scafids: np.ndarray,
+        scaf2cpd_cids: np.ndarray,
+    ):
+        self.cids = np.unique(compound_cids)
+        self.scafids = np.unique(scaf2cpd_scafids)
+
+        # sub2cpd, restricted to compounds in the compound table
+        in_cpd = np.isin(sub2cpd_cids, self.cids)
+        sub_sids = sub2cpd_sids[in_cpd]
+        sub_cpd = np.searchsorted(self.cids, sub2cpd_cids[in_cpd])
+        order = np.argsort(sub_sids)
+        sub_sids, self.sub_cpd = sub_sids[order], sub_cpd[order]
+
+        # activity rows, joined to compounds through sub2cpd
+        pos = np.searchsorted(sub_sids, activity_sids)
+        pos[pos >= len(sub_sids)] = 0
+        found = (
+            sub_sids[pos] == activity_sids
+            if len(sub_sids) > 0
+            else np.zeros(len(activity_sids), dtype=bool)
+        )
+        self.act_cpd = self.sub_cpd[pos[found]]
+        self.act_sid = activity_sids[found]
+        self.act_aid = activity_aids[found]
+        self.act_active = np.isin(activity_outcomes[found], ACTIVE_CODES)
+
+        # scaf2cpd, restricted to compounds in the compound table
+        in_cpd = np.isin(scaf2cpd_cids, self.cids)
+        self.s2c_scaf = np.searchsorted(self.scafids, scaf2cpd_scafids[in_cpd])
+        self.s2c_cpd = np.searchsorted(self.cids, scaf2cpd_cids[in_cpd])
+
+    @classmethod
+    def from_tsv_files(
+        cls,
+        activity_tsv: str,
+        sub2cpd_tsv: str,
+        compound_tsv: str,
+        scaf2cpd_tsv: str,
+    ):
+        activity_aids, activity_sids, activity_outcomes = read_activity_tsv(
+            activity_tsv
+        )
+        sub2cpd_sids, sub2cpd_cids = read_sub2cpd_tsv(sub2cpd_tsv)
+        compound_cids = read_compound_tsv(compound_tsv)
+        scaf2cpd_scafids, scaf2cpd_cids = read_scaf2cpd_tsv(scaf2cpd_tsv)
+        return cls(
+            activity_aids,
+            activity_sids,
+            activity_outcomes,
+            sub2cpd_sids,
+            sub2cpd_cids,
+            compound_cids,
+            scaf2cpd_scafids,
+            scaf2cpd_cids,
+        )
+
+    def _activity_mask(self, assay_ids) -> np.ndarray:
+        if not assay_ids:
+            return np.ones(len(self.act_aid), dtype=bool)
+        return np.isin(self.act_aid, np.asarray(list(assay_ids), dtype=np.int32))
+
+    def _compound_assays(self, assay_ids=None) -> tuple[np.ndarray, np.ndarray]:
+        """CSR (indptr, aids) of the distinct tested assays for each compound,
+        and the same for active assays."""
+        mask = self._activity_mask(assay_ids)
+        cpd, aid, active = self.act_cpd[mask], self.act_aid[mask], self.act_active[mask]
+        n_cpd = len(self.cids)
+        base = np.int64(aid.max()) + 1 if len(aid) > 0 else np.int64(1)
+        csrs = []
+        for sel in (slice(None), active):
+            keys = np.unique(cpd[sel].astype(np.int64) * base + aid[sel])
+            counts = np.bincount(keys // base, minlength=n_cpd)
+            indptr = np.concatenate(([0], np.cumsum(counts)))
+            csrs.append((indptr, (keys % base).astype(np.int32)))
+        return csrs[0], csrs[1]
+
+    def compute_compound_stats(self, assay_ids=None) -> pd.DataFrame:
+        """Compute compound table statistics (see AnnotateCompound()).
+        If assay_ids is given only activity from those assays is considered; as in the DB
+        version, substances then only count towards nsub_total if they were tested in one
+        of the selected assays."""
+        n_cpd = len(self.cids)
+        mask = self._activity_mask(assay_ids)
+        cpd, sid, aid = self.act_cpd[mask], self.act_sid[mask], self.act_aid[mask]
+        active = self.act_active[mask]
+
+        if assay_ids:
+            nsub_total = _count_distinct(cpd, sid, n_cpd)
+        else:
+            nsub_total = np.bincount(self.sub_cpd, minlength=n_cpd)
+        stats = {
+            "cid": self.cids,
+            "nsub_total": nsub_total,
+            "nsub_tested": _count_distinct(cpd, sid, n_cpd),
+            "nsub_active": _count_distinct(cpd[active], sid[active], n_cpd),
+            "nass_tested": _count_distinct(cpd, aid, n_cpd),
+            "nass_active": _count_distinct(cpd[active], aid[active], n_cpd),
+            "nsam_tested": np.bincount(cpd, minlength=n_cpd),
+            "nsam_active": np.bincount(cpd[active], minlength=n_cpd),
+        }
+        return pd.DataFrame(stats)
+
+    def _scaffold_assay_keys(
+        self,
+        scaf: np.ndarray,
+        cpd: np.ndarray,
+        csr: tuple[np.ndarray, np.ndarray],
+        max_chunk: int,
+    ) -> tuple[np.ndarray, int]:
+        """Distinct (scaffold, aid) pairs (packed as scaf * base + aid) over the given
+        scaf2cpd rows. Rows are expanded chunk-wise (whole scaffolds per chunk)
+        to keep the memory bounded by max_chunk expanded elements."""
+        indptr, aids = csr
+        base = np.int64(aids.max()) + 1 if len(aids) > 0 else np.int64(1)
+        lens = indptr[cpd + 1] - indptr[cpd]
+        per_scaf = np.bincount(scaf, weights=lens, minlength=len(self.scafids))
+        scaf_chunk = (np.cumsum(per_scaf) // max(max_chunk, 1)).astype(np.int64)
+        row_chunk = scaf_chunk[scaf]
+        order = np.argsort(row_chunk, kind="stable")
+        bounds = np.flatnonzero(np.diff(row_chunk[order])) + 1
+        keys = []
+        for rows in np.split(order, bounds):
+            row_rep, flat = _expand_csr(indptr, cpd[rows])
+            keys.append(np.unique(scaf[rows][row_rep].astype(np.int64) * base + aids[flat]))
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        return keys, base
+
+    def compute_scaffold_stats(
+        self,
+        compound_stats: pd.DataFrame,
+        assay_ids=None,
+        nass_tested_min: int = -1,
+        max_chunk: int = 50_000_000,
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Compute scaffold table statistics (see AnnotateScaffold()).
+        compound_stats should be the output of compute_compound_stats() using the same assay_ids.
+        Returns (scaffold stats, scaf2activeaid pairs). As with the DB version, only compounds with
+        nass_tested >= nass_tested_min are used for the statistics while the scaf2activeaid pairs
+        include active assays from all of the scaffold's compounds."""
+        if not np.array_equal(compound_stats["cid"].to_numpy(), self.cids):
+            raise ValueError(
+                "compound_stats must be the output of compute_compound_stats() from this engine"
+            )
+        n_scaf = len(self.scafids)
+        cpd_stats = {
+            col: compound_stats[col].to_numpy(dtype=np.int64)
+            for col in COMPOUND_STAT_COLS
+        }
+        tested_csr, active_csr = self._compound_assays(assay_ids)
+
+        keep = cpd_stats["nass_tested"][self.s2c_cpd] >= nass_tested_min
+        scaf, cpd = self.s2c_scaf[keep], self.s2c_cpd[keep]
+        tested = cpd_stats["nsam_tested"][cpd] > 0
+        active = cpd_stats["nsam_active"][cpd] > 0
+        stats = {
+            "id": self.scafids,
+            "ncpd_total": _count_distinct(scaf, cpd, n_scaf),
+            "ncpd_tested": _count_distinct(scaf[tested], cpd[tested], n_scaf),
+            "ncpd_active": _count_distinct(scaf[active], cpd[active], n_scaf),
+        }
+        for col in COMPOUND_STAT_COLS:
+            if col in ("nass_tested", "nass_active"):
+                continue
+            stats[col] = np.bincount(
+                scaf, weights=cpd_stats[col][cpd], minlength=n_scaf
+            ).astype(np.int64)
+        keys, base = self._scaffold_assay_keys(scaf, cpd, tested_csr, max_chunk)
+        stats["nass_tested"] = np.bincount(keys // base, minlength=n_scaf)
+        keys, base = self._scaffold_assay_keys(scaf, cpd, active_csr, max_chunk)
+        stats["nass_active"] = np.bincount(keys // base, minlength=n_scaf)
+        scaffold_stats = pd.DataFrame(stats)[["id"] + SCAFFOLD_STAT_COLS]
+
+        if not keep.all():
+            keys, base = self._scaffold_assay_keys(
+                self.s2c_scaf, self.s2c_cpd, active_csr, max_chunk
+            )
+        scaf2activeaid = pd.DataFrame(
+            {"scafid": self.scafids[keys // base], "aid": keys % base}
+        )
+        return scaffold_stats, scaf2activeaid
@@ -0,0 +1,198 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Memory-compact scaffold graph (generate_scaffolds.py --graph_backend compact).
+Scaffold identifiers and molecule names are interned to integer ids, and the molecule -> scaffold
+and scaffold -> parent edges are stored as NumPy arrays (CSR: per node, a slice of one array of
+ids), instead of a networkx DiGraph with a dict per node and per edge.
+The graph is built by merging shards (ScaffoldHierarchy, see utils/scaffold_hierarchy.py) in input
+order, with the same node and edge order as a graph built by one CustomHierS.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from utils.id_set import ID_BITS, CompactIdSet
+from utils.scaffold_hierarchy import ScaffoldHierarchy
+
+
+class _EdgeList:
+    """Growable (source id, target id) arrays, in order of insertion. Converted to CSR on demand."""
+
+    def __init__(self, capacity: int = 1024):
+        self.src = np.empty(capacity, dtype=np.int32)
+        self.dst = np.empty(capacity, dtype=np.int32)
+        self.size = 0
+        self.keys = CompactIdSet()  # (packed) edges in the list
+
+    def extend(self, src: np.ndarray, dst: np.ndarray):
+        """Append edges which are not in the list yet (as nx.DiGraph.add_edge)."""
+        keys = (src.astype(np.uint64) << np.uint64(ID_BITS)) | dst.astype(np.uint64)
+        is_new = self.keys.add_new(keys)
+        src, dst = src[is_new], dst[is_new]
+        end = self.size + len(src)
+        if end > len(self.src):
+            capacity = max(end, 2 * len(self.src))
+            self.src = np.resize(self.src, capacity)
+            self.dst = np.resize(self.dst, capacity)
+        self.src[self.size : end] = src
+        self.dst[self.size : end] = dst
+        self.size = end
+
+    def to_csr(self, n_nodes: int) -> tuple[np.ndarray, np.ndarray]:
+        """(indptr, indices): targets of node i are indices[indptr[i]:indptr[i + 1]], in insertion order."""
+        src, dst = self.src[: self.size], self.dst[: self.size]
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+        return indptr, dst[order]
+
+    @property
+    def nbytes(self) -> int:
+        return self.src.nbytes + self.dst.nbytes + self.keys.nbytes
+
+
+def _intern(ids: dict, values: list, value) -> int:
+    idx = ids.get(value)
+    if idx is None:
+        idx = len(values)
+        ids[value] = idx
+        values.append(value)
+    return idx
+
+
+class CompactScaffoldGraph:
+    """
+    Scaffold graph with the (read-only) interface of CustomHierS used by write_outs():
+    get_molecule_nodes(), get_scaffold_nodes(), get_scaffolds_for_molecule(), get_parent_scaffolds().
+
+    Parameters
+    ----------
+    identifier_type : str
+        Identifier used for the scaffold nodes (see CustomHierS).
+    """
+
+    def __init__(self, identifier_type: str = "canon_smiles"):
+        self.identifier_type = identifier_type
+        self.scaffold_ids = {}  # identifier -> id
+        self.scaffold_reps = []  # id -> identifier
+        self.hierarchy = np.empty(0, dtype=np.int16)  # id -> hierarchy
+        self.molecule_ids = {}  # name -> id
+        self.molecule_names = []  # id -> name
+        self.molecule_smiles = []  # id -> SMILES
+        self.molecule_edges = _EdgeList()  # molecule id -> top-level scaffold id(s)
+        self.scaffold_edges = _EdgeList()  # scaffold id -> parent scaffold ids
+        self._csr = None  # (molecule indptr, indices, scaffold indptr, indices), see _get_csr()
+        self.graph = ScaffoldHierarchy().graph
+
+    def merge(self, other: ScaffoldHierarchy):
+        """Add the nodes/edges of other (built from the molecules following those already added)."""
+        self.identifier_type = other.identifier_type
+        self._csr = None
+        scaf_ids = [
+            _intern(self.scaffold_ids, self.scaffold_reps, scaffold)
+            for scaffold in other.scaffolds
+        ]
+        self.hierarchy = np.resize(self.hierarchy, len(self.scaffold_reps))
+        self.hierarchy[scaf_ids] = list(other.scaffolds.values())
+        self.scaffold_edges.extend(*self._edge_arrays(other.scaffold_parents, scaf_ids))
+
+        mol_ids = []
+        for name, smiles in other.molecules.items():
+            mol_id = _intern(self.molecule_ids, self.molecule_names, name)
+            if mol_id == len(self.molecule_smiles):
+                self.molecule_smiles.append(smiles)
+            else:
+                self.molecule_smiles[mol_id] = smiles
+            mol_ids.append(mol_id)
+        self.molecule_edges.extend(
+            *self._edge_arrays(other.molecule_scaffolds, mol_ids)
+        )
+        for key in self.graph:
+            self.graph[key] += other.graph[key]
+
+    def _edge_arrays(self, edges: dict, src_ids: list) -> tuple[np.ndarray, np.ndarray]:
+        # edges: node -> scaffold identifiers, src_ids: (interned) id of each node
+        counts = [len(targets) for targets in edges.values()]
+        src = np.repeat(np.array(src_ids, dtype=np.int32), counts)
+        dst = np.fromiter(
+            (self.scaffold_ids[s] for targets in edges.values() for s in targets),
+            dtype=np.int32,
+            count=sum(counts),
+        )
+        return src, dst
+
+    def _get_csr(self):
+        if self._csr is None:
+            self._csr = self.molecule_edges.to_csr(
+                len(self.molecule_names)
+            ) + self.scaffold_edges.to_csr(len(self.scaffold_reps))
+        return self._csr
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the edge/hierarchy arrays (not including the identifier strings)."""
+        return (
+            self.hierarchy.nbytes
+            + self.molecule_edges.nbytes
+            + self.scaffold_edges.nbytes
+        )
+
+    @property
+    def num_scaffold_nodes(self) -> int:
+        return len(self.scaffold_reps)
+
+    @property
+    def num_molecule_nodes(self) -> int:
+        return len(self.molecule_names)
+
+    def get_scaffold_nodes(self):
+        return iter(self.scaffold_reps)
+
+    def get_molecule_nodes(self, data: bool = False):
+        if data:
+            return (
+                (name, {"smiles": smiles})
+                for name, smiles in zip(self.molecule_names, self.molecule_smiles)
+            )
+        return iter(self.molecule_names)
+
+    def _bfs(self, start: list) -> list:
+        # breadth-first traversal of parent links (as nx.bfs_tree(reverse=True))
+        _, _, indptr, indices = self._get_csr()
+        seen = set(start)
+        order = list(start)
+        queue = deque(start)
+        while queue:
+            scaf_id = queue.popleft()
+            for parent in indices[indptr[scaf_id] : indptr[scaf_id + 1]].tolist():
+                if parent not in seen:
+                    seen.add(parent)
+                    order.append(parent)
+                    queue.append(parent)
+        return order
+
+    def _to_nodes(self, scaf_ids: list, data: bool) -> list:
+        if data:
+            return [
+                (self.scaffold_reps[i], {"hierarchy": int(self.hierarchy[i])})
+                for i in scaf_ids
+            ]
+        return [self.scaffold_reps[i] for i in scaf_ids]
+
+    def get_scaffolds_for_molecule(self, molecule_id, data: bool = False) -> list:
+        mol_id = self.molecule_ids.get(molecule_id)
+        if mol_id is None:
+            return []
+        indptr, indices, _, _ = self._get_csr()
+        start = indices[indptr[mol_id] : indptr[mol_id + 1]].tolist()
+        return self._to_nodes(self._bfs(start), data)
+
+    def get_parent_scaffolds(self, scaffold, data: bool = False) -> list:
+        scaf_id = self.scaffold_ids.get(scaffold)
+        if scaf_id is None:
+            return []
+        # first entry is the query scaffold
+        return self._to_nodes(self._bfs([scaf_id])[1:], data)
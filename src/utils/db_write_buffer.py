@@ -0,0 +1,120 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Batched DB writer shared by the annotation scripts (annotate_db_assaystats.py, annotate_db_scores.py).
+Rows are collected in memory and streamed to a temp table with COPY FROM STDIN. Each flush then
+applies them to the target table with a single UPDATE ... FROM (or INSERT ... SELECT) and one commit,
+instead of one statement + commit per row.
+"""
+
+import io
+
+from loguru import logger
+
+
+def _format_copy_value(value) -> str:
+    # COPY text format: NULL is \N, tabs/newlines never occur in our (numeric) columns
+    if value is None:
+        return "\\N"
+    return str(value)
+
+
+class CopyWriteBuffer:
+    """
+    Write buffer for a single target table.
+
+    Parameters
+    ----------
+    db : psycopg2 connection
+    table : str
+        Target table (can be schema-qualified).
+    columns : list[str]
+        Columns of the rows passed to add(), in order.
+    key_columns : list[str], optional
+        If given, rows update the target rows matching on these columns (UPDATE ... FROM).
+        If None, rows are inserted into the target (INSERT ... SELECT).
+    flush_size : int, optional
+        Number of buffered rows which triggers a flush. The default is 10,000.
+    """
+
+    def __init__(
+        self,
+        db,
+        table: str,
+        columns: list[str],
+        key_columns: list[str] = None,
+        flush_size: int = 10_000,
+    ):
+        self.db = db
+        self.table = table
+        self.columns = list(columns)
+        self.key_columns = list(key_columns) if key_columns is not None else None
+        self.flush_size = max(flush_size, 1)
+        self.rows = []
+        self.n_written = 0
+        self.n_err = 0
+        self.failed = False  # set once any flush failed (its rows are lost)
+        self.temp_table = f"_copybuf_{table.replace('.', '_')}_{id(self)}"
+        cols = ", ".join(self.columns)
+        cur = self.db.cursor()
+        # (committed right away so that a rollback of a failed flush keeps the temp table)
+        cur.execute(
+            f"CREATE TEMP TABLE {self.temp_table} AS SELECT {cols} FROM {self.table} WITH NO DATA"
+        )
+        self.db.commit()
+        cur.close()
+
+    def _apply_sql(self) -> str:
+        cols = ", ".join(self.columns)
+        if self.key_columns is None:
+            return f"INSERT INTO {self.table} ({cols}) SELECT {cols} FROM {self.temp_table}"
+        value_columns = [c for c in self.columns if c not in self.key_columns]
+        set_clause = ", ".join(f"{c} = b.{c}" for c in value_columns)
+        where_clause = " AND ".join(f"t.{c} = b.{c}" for c in self.key_columns)
+        return f"UPDATE {self.table} t SET {set_clause} FROM {self.temp_table} b WHERE {where_clause}"
+
+    def add(self, row: tuple) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Write all buffered rows to the target table. Returns False if the write failed:
+        the rows are then dropped (counted in n_err) and failed is set."""
+        if len(self.rows) == 0:
+            return True
+        rows, self.rows = self.rows, []
+        data = io.StringIO(
+            "".join(
+                "\t".join(_format_copy_value(v) for v in row) + "\n" for row in rows
+            )
+        )
+        cur = self.db.cursor()
+        try:
+            cur.copy_expert(
+                f"COPY {self.temp_table} ({', '.join(self.columns)}) FROM STDIN",
+                data,
+            )
+            cur.execute(self._apply_sql())
+            cur.execute(f"TRUNCATE {self.temp_table}")
+            self.db.commit()
+        except Exception as e:
+            logger.error(e)
+            self.db.rollback()
+            self.n_err += len(rows)
+            self.failed = True
+            return False
+        finally:
+            cur.close()
+        self.n_written += len(rows)
+        return True
+
+    def close(self) -> int:
+        """Flush remaining rows and drop the temp table. Returns number of rows written in total."""
+        self.flush()
+        cur = self.db.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {self.temp_table}")
+        self.db.commit()
+        cur.close()
+        return self.n_written
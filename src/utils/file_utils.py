@@ -7,7 +7,9 @@ File-related utilities shared between multiple scripts.
 
 import csv
 import json
+import os
 import sys
+import zlib
 
 import pandas as pd
 
@@ -33,6 +35,152 @@ def close_file(f):
         f.close()
 
 
+def is_parquet_file(file_path: str) -> bool:
+    return str(file_path).endswith(".parquet")
+
+
+def read_table(
+    file_path: str, usecols: list[str] = None, dtype: dict = None, sep: str = "\t"
+) -> pd.DataFrame:
+    """Read a pipeline output table, either TSV or Parquet (if file_path ends with .parquet)."""
+    if is_parquet_file(file_path):
+        df = pd.read_parquet(file_path, columns=usecols)
+        return df.astype(dtype) if dtype is not None else df
+    return pd.read_csv(file_path, sep=sep, usecols=usecols, dtype=dtype)
+
+
+class _ChecksumFile:
+    """Binary file wrapper (for csv.writer) which tracks the number of bytes written and their CRC32."""
+
+    def __init__(self, f, n_bytes: int = 0, crc32: int = 0):
+        self.f = f
+        self.n_bytes = n_bytes
+        self.crc32 = crc32
+
+    def write(self, s: str):
+        b = s.encode("utf-8")
+        self.crc32 = zlib.crc32(b, self.crc32)
+        self.n_bytes += len(b)
+        return self.f.write(b)
+
+
+def file_crc32(file_path: str, n_bytes: int, chunk_size: int = 2**24) -> int:
+    """CRC32 of the first n_bytes of a file (raises ValueError if the file is shorter)."""
+    crc32 = 0
+    remaining = n_bytes
+    with open(file_path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if len(chunk) == 0:
+                raise ValueError(
+                    f"{file_path} is shorter than expected ({n_bytes - remaining} < {n_bytes} bytes)"
+                )
+            crc32 = zlib.crc32(chunk, crc32)
+            remaining -= len(chunk)
+    return crc32
+
+
+class TsvTableWriter:
+    """
+    Writes DataFrames (rows only, columns in order) to a TSV file.
+    Keeps track of the file size (n_bytes) and CRC32 of the file contents (crc32).
+    If append is given, rows are appended to the file which should have the given crc32.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        header: list[str] = None,
+        append: bool = False,
+        crc32: int = 0,
+    ):
+        self.f = open(file_path, "ab" if append else "wb")
+        n_bytes = os.path.getsize(file_path) if append else 0
+        self.checksum_file = _ChecksumFile(self.f, n_bytes, crc32)
+        self.writer = csv.writer(self.checksum_file, delimiter="\t")
+        if header is not None:
+            self.writer.writerow(header)
+
+    @property
+    def n_bytes(self) -> int:
+        return self.checksum_file.n_bytes
+
+    @property
+    def crc32(self) -> int:
+        return self.checksum_file.crc32
+
+    def write_df(self, df: pd.DataFrame):
+        self.writer.writerows(df.values)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetTableWriter:
+    """
+    Writes DataFrames to a Parquet file with the given schema, in row groups of (at least) row_group_size rows.
+    DataFrame columns are matched to the schema fields by position.
+    schema maps column name => Arrow type name (e.g., {"AID": "int32", "SID": "int64"}).
+    metadata (str => str) is stored in the file's schema (see read_parquet_metadata()).
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        schema: dict[str, str],
+        row_group_size: int = 1_000_000,
+        compression: str = "zstd",
+        metadata: dict[str, str] = None,
+    ):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [(name, pa.type_for_alias(type_name)) for name, type_name in schema.items()],
+            metadata=metadata,
+        )
+        self.writer = pq.ParquetWriter(file_path, self.schema, compression=compression)
+        self.row_group_size = row_group_size
+        self.tables = []
+        self.n_buffered = 0
+
+    def write_df(self, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        arrays = [
+            self.pa.array(df.iloc[:, i], type=field.type, from_pandas=True)
+            for i, field in enumerate(self.schema)
+        ]
+        self.tables.append(self.pa.Table.from_arrays(arrays, schema=self.schema))
+        self.n_buffered += len(df)
+        if self.n_buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        table = self.pa.concat_tables(self.tables)
+        self.writer.write_table(table, row_group_size=len(table))
+        self.tables = []
+        self.n_buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def read_parquet_metadata(file_path: str) -> dict[str, str]:
+    # key/value metadata of the file's schema (e.g., from ParquetTableWriter(metadata=...))
+    import pyarrow.parquet as pq
+
+    metadata = pq.read_schema(file_path).metadata or {}
+    return {k.decode(): v.decode() for k, v in metadata.items()}
+
+
 def read_aid_file(aid_file_path: str) -> list[int]:
     with open(aid_file_path, "r") as file:
         aid_list = [int(line.strip()) for line in file if line.strip().isdigit()]
@@ -0,0 +1,96 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Persistent (SQLite) cache of HierS fragmentation results, used by CustomHierS (see utils/hiers.py)
+so that repeated runs of generate_scaffolds.py (e.g., monthly rebuilds) only fragment new molecules.
+For each molecule (keyed by canonical SMILES) stores its number of ring systems, top-level (Murcko)
+scaffold, and the parent scaffolds of every scaffold in its hierarchy.
+Cached results are only valid for the same scaffold identifier/preprocessing and library versions
+(see config), the cache is cleared if these change.
+"""
+
+import json
+import sqlite3
+import zlib
+
+import rdkit
+import scaffoldgraph
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS molecule (smiles TEXT PRIMARY KEY, atom_order TEXT, record BLOB)",
+]
+
+
+class FragmentCache:
+    """
+    Parameters
+    ----------
+    file_path : str
+        SQLite file (created if it does not exist).
+    config : dict
+        Settings which determine the fragmentation results (identifier type, scaffold preprocessing).
+        Library versions are added to these.
+    flush_size : int, optional
+        Number of new entries which triggers a write to the file. The default is 10,000.
+    """
+
+    def __init__(self, file_path: str, config: dict, flush_size: int = 10_000):
+        # (timeout: parallel workers can share one cache file)
+        self.db = sqlite3.connect(file_path, timeout=600)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        for sql in SCHEMA:
+            self.db.execute(sql)
+        self.config = json.dumps(
+            dict(
+                config, rdkit=rdkit.__version__, scaffoldgraph=scaffoldgraph.__version__
+            ),
+            sort_keys=True,
+        )
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if row is None or row[0] != self.config:
+            self.db.execute("DELETE FROM molecule")
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('config', ?)",
+                (self.config,),
+            )
+        self.db.commit()
+        self.flush_size = flush_size
+        self.new_records = []
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def get(self, smiles: str, atom_order: str) -> dict | None:
+        """
+        Cached record of a molecule, None if not cached.
+        atom_order (non-canonical SMILES) must match as well: the order in which parent scaffolds
+        are found depends on the atom order of the molecule, which determines the graph edge order.
+        """
+        row = self.db.execute(
+            "SELECT atom_order, record FROM molecule WHERE smiles = ?", (smiles,)
+        ).fetchone()
+        if row is None or row[0] != atom_order:
+            self.n_misses += 1
+            return None
+        self.n_hits += 1
+        return json.loads(zlib.decompress(row[1]))
+
+    def add(self, smiles: str, atom_order: str, record: dict):
+        self.new_records.append(
+            (smiles, atom_order, zlib.compress(json.dumps(record).encode()))
+        )
+        if len(self.new_records) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO molecule (smiles, atom_order, record) VALUES (?, ?, ?)",
+                self.new_records,
+            )
+        self.new_records = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
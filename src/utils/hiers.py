@@ -8,6 +8,8 @@ Moving to separate file from generate_scaffolds.py to reduce clutter.
 - Credit to useful-rdkit-utils: https://github.com/PatWalters/useful_rdkit_utils/tree/master
 """
 
+from collections import OrderedDict
+
 import loguru
 import scaffoldgraph as sg
 from rdkit import Chem
@@ -18,10 +20,13 @@ from scaffoldgraph.core.fragment import (
 from scaffoldgraph.core.graph import init_molecule_name
 from scaffoldgraph.core.scaffold import Scaffold
 from scaffoldgraph.io import *
+from scaffoldgraph.io.supplier import MolSupplier
 from scaffoldgraph.utils import suppress_rdlogger
 from tqdm import tqdm
 from useful_rdkit_utils import RingSystemFinder
 
+from utils.fragment_cache import FragmentCache
+
 
 def canon_smiles(mol: Chem.Mol, kekule=False):
     # beware of oscillating SMILES when using kekule=True !
@@ -62,16 +67,57 @@ def canon_smiles(mol: Chem.Mol, kekule=False):
         return original_smiles
 
 
+class MemoizedHash:
+    """
+    Bounded (LRU) memo for a scaffold hash function (e.g., canon_smiles), keyed on the
+    non-canonical SMILES of the molecule, which is cheap to compute. Scaffold identifiers are
+    recomputed on every lookup (ScaffoldGraph does not store them) and the same fragments
+    occur many times across a library, so most calls are memo hits.
+    """
+
+    def __init__(self, hash_func, max_size: int = 200_000):
+        self.hash_func = hash_func
+        self.max_size = max_size
+        self.memo = OrderedDict()
+        self.n_calls = 0
+        self.n_hits = 0
+
+    def __call__(self, mol: Chem.Mol) -> str:
+        self.n_calls += 1
+        key = Chem.MolToSmiles(mol, canonical=False)
+        value = self.memo.get(key)
+        if value is not None:
+            self.n_hits += 1
+            self.memo.move_to_end(key)
+            return value
+        value = self.hash_func(mol)
+        self.memo[key] = value
+        if len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+        return value
+
+
 class CustomHierS(sg.HierS):
     """
     This is a slightly modified version of the original HierS algorithm from ScaffoldGraph. it uses the following changes:
     1) Includes molecules with no top-level scaffold in the graph.
     2) Supports multiple identifier types, rather than only canonical aromatic SMILES
     3) Counts number of ring systems rather than number of rings when determining filter
+    4) Optionally reuses fragmentation results from previous runs (fragment_cache_file, see FragmentCache)
+    5) Memoizes scaffold identifiers (see MemoizedHash, hash_memo_size)
     """
 
-    def __init__(self, *args, logger=None, identifier_type="canon_smiles", **kwargs):
+    def __init__(
+        self,
+        *args,
+        logger=None,
+        identifier_type="canon_smiles",
+        fragment_cache_file=None,
+        hash_memo_size=200_000,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
+        self.fragment_cache_file = fragment_cache_file
         # Track scaffolds that couldn't be Kekulized
         # (these structures are invalid for RDKit PostgreSQL cartridge)
         self.non_kekule_scaffolds = set()
@@ -81,13 +127,56 @@ class CustomHierS(sg.HierS):
             logger = loguru.logger
         self.logger = logger
         if identifier_type == "canon_smiles":
-            self.hash_func = canon_smiles
+            hash_func = canon_smiles
         elif identifier_type == "kekule_smiles":
-            self.hash_func = lambda mol: canon_smiles(mol, kekule=True)
+            hash_func = lambda mol: canon_smiles(mol, kekule=True)
         elif identifier_type == "inchi":
-            self.hash_func = Chem.MolToInchi
+            hash_func = Chem.MolToInchi
         else:
             raise ValueError(f"Unrecognized identifier_type: {identifier_type}")
+        self.hash_func = MemoizedHash(hash_func, hash_memo_size)
+
+    @classmethod
+    def from_smiles_text(
+        cls,
+        text: str,
+        delimiter: str = " ",
+        smiles_column: int = 0,
+        name_column: int = 1,
+        header: bool = False,
+        ring_cutoff: int = 10,
+        progress: bool = False,
+        annotate: bool = True,
+        flatten_isotopes: bool = False,
+        keep_largest_fragment: bool = False,
+        discharge_and_deradicalize: bool = False,
+        **kwargs,
+    ):
+        """Construct the graph from the contents of a SMILES file.
+        Same as from_smiles_file (same parser and defaults), used to build graphs for
+        parts of a SMILES file (see generate_scaffolds.py --workers).
+        """
+        supplier = MolSupplier(
+            Chem.SmilesMolSupplierFromText(
+                text,
+                delimiter=delimiter,
+                smilesColumn=smiles_column,
+                nameColumn=name_column,
+                titleLine=header,
+                sanitize=True,
+            )
+        )
+        instance = cls(**kwargs)
+        init_args = dict(
+            flatten_isotopes=flatten_isotopes,
+            keep_largest=keep_largest_fragment,
+            discharge=discharge_and_deradicalize,
+            annotate=annotate,
+        )
+        instance._construct(
+            supplier, init_args, ring_cutoff=ring_cutoff, progress=progress
+        )
+        return instance
 
     def _process_no_top_level(self, molecule):
         """Private: Process molecules with no top-level scaffold.
@@ -106,6 +195,22 @@ class CustomHierS(sg.HierS):
         )
         return None
 
+    def _get_top_level_scaffold(self, molecule, init_args):
+        """Private: Return the top-level scaffold of a molecule and its annotation
+        (None, None if the molecule has no top-level scaffold)."""
+        scaffold_rdmol = get_murcko_scaffold(molecule)
+        if scaffold_rdmol.GetNumAtoms() <= 0:
+            return None, None
+        scaffold_rdmol = self._preprocess_scaffold(scaffold_rdmol, init_args)
+        scaffold = Scaffold(scaffold_rdmol)
+        # CHANGE: override default hash_func
+        scaffold.hash_func = self.hash_func
+        # END CHANGE
+        annotation = None
+        if init_args.get("annotate") is True:
+            annotation = get_annotated_murcko_scaffold(molecule, scaffold_rdmol, False)
+        return scaffold, annotation
+
     def _initialize_scaffold(self, molecule, init_args):
         """Initialize the top-level scaffold for a molecule.
         Modified from the original code to Kekulize the scaffold.
@@ -132,17 +237,9 @@ class CustomHierS(sg.HierS):
             generation).
 
         """
-        scaffold_rdmol = get_murcko_scaffold(molecule)
-        if scaffold_rdmol.GetNumAtoms() <= 0:
+        scaffold, annotation = self._get_top_level_scaffold(molecule, init_args)
+        if scaffold is None:
             return self._process_no_top_level(molecule)
-        scaffold_rdmol = self._preprocess_scaffold(scaffold_rdmol, init_args)
-        scaffold = Scaffold(scaffold_rdmol)
-        # CHANGE: override default hash_func
-        scaffold.hash_func = self.hash_func
-        # END CHANGE
-        annotation = None
-        if init_args.get("annotate") is True:
-            annotation = get_annotated_murcko_scaffold(molecule, scaffold_rdmol, False)
         self.add_scaffold_node(scaffold)
         self.add_molecule_node(molecule)
         self.add_molecule_edge(molecule, scaffold, annotation=annotation)
@@ -162,6 +259,67 @@ class CustomHierS(sg.HierS):
                 if parent.ring_systems.count > 1:
                     self._hierarchy_constructor(parent)
 
+    def _fragment_closure(self, scaffold, closure: dict = None) -> dict:
+        """Private: Return the parents (identifier, hierarchy, number of ring systems) of
+        scaffold and of all scaffolds above it, in the order _hierarchy_constructor finds them
+        when none of them are in the graph yet."""
+        if closure is None:
+            closure = {}
+        parents = [p for p in self.fragmenter.fragment(scaffold) if p]
+        for parent in parents:
+            parent.hash_func = self.hash_func
+        closure[scaffold.get_canonical_identifier()] = [
+            (p.get_canonical_identifier(), p.rings.count, p.ring_systems.count)
+            for p in parents
+        ]
+        for parent in parents:
+            if (
+                parent.ring_systems.count > 1
+                and parent.get_canonical_identifier() not in closure
+            ):
+                self._fragment_closure(parent, closure)
+        return closure
+
+    def _molecule_record(self, molecule, init_args, n_ring_systems: int) -> dict:
+        """Private: Fragmentation results of a molecule, as stored in the FragmentCache."""
+        scaffold, annotation = self._get_top_level_scaffold(molecule, init_args)
+        if scaffold is None:
+            return dict(n_ring_systems=n_ring_systems, scaffold=None)
+        return dict(
+            n_ring_systems=n_ring_systems,
+            scaffold=scaffold.get_canonical_identifier(),
+            hierarchy=scaffold.rings.count,
+            annotation=annotation,
+            parents=self._fragment_closure(scaffold),
+        )
+
+    def _add_molecule_record(self, molecule, record: dict):
+        """Private: Add a molecule to the graph from its fragmentation results (see _molecule_record).
+        Same as _initialize_scaffold + _hierarchy_constructor (same nodes, edges, and edge order)."""
+        scaffold_id = record["scaffold"]
+        if scaffold_id is None:
+            return self._process_no_top_level(molecule)
+        self.add_node(scaffold_id, type="scaffold", hierarchy=record["hierarchy"])
+        self.add_molecule_node(molecule)
+        self.add_edge(
+            scaffold_id,
+            molecule.GetProp("_Name"),
+            type=0,
+            annotation=record["annotation"],
+        )
+        self._add_hierarchy_record(scaffold_id, record["parents"])
+
+    def _add_hierarchy_record(self, child_id: str, parents: dict):
+        """Private: Same as _hierarchy_constructor, with parents from _fragment_closure."""
+        for parent_id, hierarchy, n_ring_systems in parents[child_id]:
+            if parent_id in self.nodes:
+                self.add_edge(parent_id, child_id, type=1)
+            else:
+                self.add_node(parent_id, type="scaffold", hierarchy=hierarchy)
+                self.add_edge(parent_id, child_id, type=1)
+                if n_ring_systems > 1:
+                    self._add_hierarchy_record(parent_id, parents)
+
     @suppress_rdlogger()
     def _construct(self, molecules, init_args, ring_cutoff=10, progress=False):
         """Private method for graph construction, called by constructors.
@@ -195,6 +353,12 @@ class CustomHierS(sg.HierS):
 
         """
         desc, progress = self.__class__.__name__, progress is False
+        cache = None
+        if self.fragment_cache_file is not None:
+            cache = FragmentCache(
+                self.fragment_cache_file,
+                dict(identifier_type=self.identifier_type, **init_args),
+            )
         for molecule in tqdm(
             molecules,
             disable=progress,
@@ -206,8 +370,18 @@ class CustomHierS(sg.HierS):
                 self.logger.info("Molecule was none")
                 continue
             init_molecule_name(molecule)
+            # CHANGE: reuse fragmentation results of previous runs
+            record = None
+            if cache is not None:
+                smiles = Chem.MolToSmiles(molecule)
+                atom_order = Chem.MolToSmiles(molecule, canonical=False)
+                record = cache.get(smiles, atom_order)
+            # END CHANGE
             # CHANGE: count ring systems instead of number of rings
-            n_ring_systems = len(self.rsf.find_ring_systems(molecule))
+            if record is not None:
+                n_ring_systems = record["n_ring_systems"]
+            else:
+                n_ring_systems = len(self.rsf.find_ring_systems(molecule))
             if n_ring_systems > ring_cutoff:
                 name = molecule.GetProp("_Name")
                 self.logger.warning(
@@ -219,6 +393,19 @@ class CustomHierS(sg.HierS):
                 # END CHANGE
                 self.graph["num_filtered"] = self.graph.get("num_filtered", 0) + 1
                 continue
+            if cache is not None:
+                if record is None:
+                    record = self._molecule_record(molecule, init_args, n_ring_systems)
+                    cache.add(smiles, atom_order, record)
+                self._add_molecule_record(molecule, record)
+                continue
             scaffold = self._initialize_scaffold(molecule, init_args)
             if scaffold is not None:
                 self._hierarchy_constructor(scaffold)
+        if cache is not None:
+            self.logger.info(
+                f"Fragment cache: {cache.n_hits} molecules reused, {cache.n_misses} fragmented ({self.fragment_cache_file})"
+            )
+            cache.close()
+        self.graph["num_hash_calls"] = self.hash_func.n_calls
+        self.graph["num_hash_hits"] = self.hash_func.n_hits
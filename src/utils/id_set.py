@@ -0,0 +1,91 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Memory-compact set of (non-negative) integer ids / id pairs, used to deduplicate rows
+written by pubchem_assay_activities.py. Pairs are packed into one 64-bit key and keys are
+stored in a few sorted NumPy arrays (8 bytes/key, vs. ~100+ bytes/entry for a set of tuples),
+with vectorized membership tests.
+"""
+
+import numpy as np
+import pandas as pd
+
+# PubChem SIDs/CIDs fit in 32 bits, so a (SID, CID) pair fits in one 64-bit key
+ID_BITS = 32
+NA_ID = (1 << ID_BITS) - 1  # stands in for missing (<NA>) ids
+
+
+def id_keys(ids: pd.Series) -> np.ndarray:
+    """Convert (nullable) integer ids to uint64 keys, missing ids map to NA_ID."""
+    keys = ids.to_numpy(dtype=np.int64, na_value=NA_ID)
+    if len(keys) > 0 and (keys.min() < 0 or keys.max() > NA_ID):
+        raise ValueError(f"ids must be in range [0, {NA_ID}), given: {ids}")
+    return keys.astype(np.uint64)
+
+
+def pair_keys(first: pd.Series, second: pd.Series) -> np.ndarray:
+    """Pack two (nullable) integer id columns into one uint64 key per row."""
+    return (id_keys(first) << np.uint64(ID_BITS)) | id_keys(second)
+
+
+class CompactIdSet:
+    """
+    Insert-only set of uint64 keys.
+    Keys are kept in sorted runs which are merged when a run is at least half the size of the
+    previous one (so there are O(log n) runs and each key is merged O(log n) times).
+    """
+
+    def __init__(self):
+        self.runs = []
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(run.nbytes for run in self.runs)
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """Boolean mask: which of keys are in the set."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        found = np.zeros(len(keys), dtype=bool)
+        for run in self.runs:
+            pos = np.searchsorted(run, keys)
+            pos[pos == len(run)] = 0
+            found |= run[pos] == keys
+        return found
+
+    def add_new(self, keys: np.ndarray) -> np.ndarray:
+        """Add keys to the set. Returns a boolean mask marking the first occurrence
+        of each key which was not already in the set (i.e., the rows to write)."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        is_new = np.zeros(len(keys), dtype=bool)
+        if len(keys) == 0:
+            return is_new
+        uniq, first_idx = np.unique(keys, return_index=True)
+        new = ~self.contains(uniq)
+        is_new[first_idx[new]] = True
+        self._add_run(uniq[new])
+        return is_new
+
+    def add_unseen(self, keys: np.ndarray) -> np.ndarray:
+        """Add keys to the set. Returns a boolean mask marking every key which was not in the set
+        before this call (unlike add_new(), repeated keys are all marked)."""
+        keys = np.asarray(keys, dtype=np.uint64)
+        if len(keys) == 0:
+            return np.zeros(0, dtype=bool)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        new = ~self.contains(uniq)
+        self._add_run(uniq[new])
+        return new[inverse.ravel()]
+
+    def _add_run(self, run: np.ndarray):
+        # run must be sorted and disjoint from the set
+        if len(run) == 0:
+            return
+        self.runs.append(run)
+        while len(self.runs) > 1 and 2 * len(self.runs[-1]) >= len(self.runs[-2]):
+            last = self.runs.pop()
+            # (runs are disjoint) stable sort = timsort, which merges the two sorted runs in linear time
+            self.runs[-1] = np.sort(np.concatenate((self.runs[-1], last)), kind="stable")
@@ -0,0 +1,131 @@
+"""
+@author Jack Ringer
+Date: 10/16/2026
+Description:
+Plain-Python snapshot of a scaffold graph (CustomHierS), used by generate_scaffolds.py --workers.
+Each worker builds a CustomHierS graph for a shard of the input molecules and returns it as a
+ScaffoldHierarchy (molecules, scaffolds with their hierarchy + parent links), which are then
+merged in input order. Merging mirrors how the nodes/edges would have been added to a single
+graph, so the merged hierarchy has the same node order (=> scaffold ids) and traversal order
+(=> scaf2scaf strings) as a graph built by one process.
+"""
+
+from collections import deque
+
+
+class ScaffoldHierarchy:
+    """
+    Scaffold graph with the (read-only) interface of CustomHierS used by write_outs():
+    get_molecule_nodes(), get_scaffold_nodes(), get_scaffolds_for_molecule(), get_parent_scaffolds().
+
+    Parameters
+    ----------
+    identifier_type : str
+        Identifier used for the scaffold nodes (see CustomHierS).
+    """
+
+    def __init__(self, identifier_type: str = "canon_smiles"):
+        self.identifier_type = identifier_type
+        # (dicts keep insertion order, as the networkx graph does)
+        self.molecules = {}  # name -> SMILES
+        self.molecule_scaffolds = {}  # name -> top-level scaffold(s)
+        self.scaffolds = {}  # identifier -> hierarchy
+        self.scaffold_parents = {}  # identifier -> parent scaffolds (in edge order)
+        # summary counts (see CustomHierS), summed when merging
+        self.graph = {
+            "num_filtered": 0,
+            "num_linear": 0,
+            "num_hash_calls": 0,
+            "num_hash_hits": 0,
+        }
+
+    @classmethod
+    def from_hiers(cls, scaffold_graph) -> "ScaffoldHierarchy":
+        """Snapshot of a CustomHierS graph."""
+        instance = cls(scaffold_graph.identifier_type)
+        for node, data in scaffold_graph.nodes(data=True):
+            parents = list(scaffold_graph.predecessors(node))
+            if data.get("type") == "scaffold":
+                instance.scaffolds[node] = data["hierarchy"]
+                instance.scaffold_parents[node] = parents
+            elif data.get("type") == "molecule":
+                instance.molecules[node] = data["smiles"]
+                instance.molecule_scaffolds[node] = parents
+        for key in instance.graph:
+            instance.graph[key] = scaffold_graph.graph.get(key, 0)
+        return instance
+
+    @staticmethod
+    def _add_edges(edges: dict, node, nodes: list):
+        # as nx.DiGraph.add_edge: existing edges keep their position
+        if node not in edges:
+            edges[node] = list(nodes)
+            return
+        existing = edges[node]
+        existing.extend(n for n in nodes if n not in existing)
+
+    def merge(self, other: "ScaffoldHierarchy"):
+        """Add the nodes/edges of other (built from the molecules following those of self)."""
+        self.identifier_type = other.identifier_type
+        for name, smiles in other.molecules.items():
+            self.molecules[name] = smiles
+            self._add_edges(
+                self.molecule_scaffolds, name, other.molecule_scaffolds[name]
+            )
+        for scaffold, hierarchy in other.scaffolds.items():
+            self.scaffolds[scaffold] = hierarchy
+            self._add_edges(
+                self.scaffold_parents, scaffold, other.scaffold_parents[scaffold]
+            )
+        for key in self.graph:
+            self.graph[key] += other.graph[key]
+
+    def clear_molecules(self):
+        """Drop the molecule nodes (e.g., once written out), scaffolds are kept."""
+        self.molecules.clear()
+        self.molecule_scaffolds.clear()
+
+    @property
+    def num_scaffold_nodes(self) -> int:
+        return len(self.scaffolds)
+
+    @property
+    def num_molecule_nodes(self) -> int:
+        return len(self.molecules)
+
+    def get_scaffold_nodes(self):
+        return iter(self.scaffolds)
+
+    def get_molecule_nodes(self, data: bool = False):
+        if data:
+            return ((name, {"smiles": smiles}) for name, smiles in self.molecules.items())
+        return iter(self.molecules)
+
+    def _bfs(self, start: list) -> list:
+        # breadth-first traversal of parent links (as nx.bfs_tree(reverse=True))
+        seen = set(start)
+        order = list(start)
+        queue = deque(start)
+        while queue:
+            for parent in self.scaffold_parents[queue.popleft()]:
+                if parent not in seen:
+                    seen.add(parent)
+                    order.append(parent)
+                    queue.append(parent)
+        return order
+
+    def get_scaffolds_for_molecule(self, molecule_id, data: bool = False) -> list:
+        if molecule_id not in self.molecule_scaffolds:
+            return []
+        scaffolds = self._bfs(self.molecule_scaffolds[molecule_id])
+        if data:
+            return [(s, {"hierarchy": self.scaffolds[s]}) for s in scaffolds]
+        return scaffolds
+
+    def get_parent_scaffolds(self, scaffold, data: bool = False) -> list:
+        if scaffold not in self.scaffold_parents:
+            return []
+        parents = self._bfs([scaffold])[1:]  # first entry is the query scaffold
+        if data:
+            return [(s, {"hierarchy": self.scaffolds[s]}) for s in parents]
+        return parents